@@ -0,0 +1,58 @@
+# benchmarks/analytic_accuracy.py
+# Точность аналитического (логнормального) движка относительно Монте-Карло
+# для всех стратегий из STRATEGY_TEMPLATES на диапазоне сроков.
+# Запуск из корня проекта:  python -m benchmarks.analytic_accuracy
+import time
+
+import numpy as np
+
+from portfolio_bot.database.catalog import FundCatalog
+from portfolio_bot.database.funds_data import ALL_FUNDS, STRATEGY_TEMPLATES
+from portfolio_bot.domain.calculator import PortfolioCalculator
+
+TERMS_MONTHS = [1, 3, 6, 12, 24, 36, 60, 120, 240, 360]
+AMOUNT = 100000
+MONTHLY_CONTRIBUTION = 10000
+# Сколько независимых прогонов Монте-Карло усреднять как "эталон"
+REFERENCE_RUNS = 10
+
+
+def relative_errors(analytic: dict, reference: dict) -> dict:
+    """Максимальная по горизонтам относительная ошибка каждой полосы (в процентах)."""
+    return {
+        band: 100 * np.max(np.abs(np.asarray(analytic[band][1:]) / reference[band][1:] - 1))
+        for band in ('min', 'avg', 'max')
+    }
+
+
+def main():
+    calculator = PortfolioCalculator(repository=None)
+    catalog = FundCatalog('benchmark', ALL_FUNDS, STRATEGY_TEMPLATES)
+    print(f"{'стратегия':>22} {'срок':>5} {'min, %':>7} {'avg, %':>7} {'max, %':>7} {'MC, мс':>8} {'аналит., мс':>11}")
+
+    for risk_profile in STRATEGY_TEMPLATES:
+        total_return, total_volatility = catalog.template_metrics[risk_profile]
+        forecast_args = dict(amount=AMOUNT, annual_return=total_return, annual_volatility=total_volatility,
+                             monthly_contribution=MONTHLY_CONTRIBUTION, risk_profile=risk_profile)
+
+        for num_months in TERMS_MONTHS:
+            started = time.perf_counter()
+            runs = [
+                calculator._generate_forecast_monte_carlo(num_months=num_months, forecast_mode='streaming',
+                                                          seed_key=(risk_profile, num_months, run), **forecast_args)
+                for run in range(REFERENCE_RUNS)
+            ]
+            mc_ms = (time.perf_counter() - started) / REFERENCE_RUNS * 1000
+            reference = {band: np.mean([run[band] for run in runs], axis=0) for band in ('min', 'avg', 'max')}
+
+            started = time.perf_counter()
+            analytic = calculator._generate_forecast_analytic(num_months=num_months, **forecast_args)
+            analytic_ms = (time.perf_counter() - started) * 1000
+
+            errors = relative_errors(analytic, reference)
+            print(f"{risk_profile:>22} {num_months:>5} {errors['min']:>7.2f} {errors['avg']:>7.2f} {errors['max']:>7.2f} "
+                  f"{mc_ms:>8.2f} {analytic_ms:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# benchmarks/calculator_suite.py
+# Набор микробенчмарков PortfolioCalculator.calculate с проверкой на регрессии.
+#
+# Покрывает все риск-профили на сроках от 1 до 360 мес. с пополнениями и без,
+# ручной выбор фондов (selected_funds), режим защиты капитала (консервативный
+# профиль до 12 мес.) и "холодные" расчеты с пустым кэшем единичных путей.
+# Для каждого случая — p50/p95 латентности и пик аллокаций (tracemalloc).
+#
+# Запуск из корня проекта:
+#     python -m benchmarks.calculator_suite                    # сравнить с базовой линией
+#     python -m benchmarks.calculator_suite --update-baseline  # перезаписать базовую линию
+# Код выхода 1, если хотя бы один случай медленнее базовой линии больше допуска,
+# а также если базовая линия снята в другом окружении (версии Python/NumPy, машина):
+# сравнивать с ней бессмысленно. С --allow-foreign-baseline такой прогон только
+# замеряет случаи, без сравнения, и завершается с кодом 0.
+# Базовая линия лежит в репозитории (benchmarks/baselines/calculator_suite.json)
+# и имеет смысл только на той машине, где она снята: после смены машины ее надо обновить.
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from portfolio_bot.database.repository import CombinedRepository
+from portfolio_bot.domain.calculator import PortfolioCalculator
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines', 'calculator_suite.json')
+BASELINE_VERSION = 1
+
+TERMS_MONTHS = [1, 12, 60, 360]
+NO_LOSS_TERMS_MONTHS = [1, 6, 12]
+CONTRIBUTIONS = [0, 10000]
+AMOUNT = 100000
+REPEATS = 30
+# Случай с превышением допуска перемеряется, чтобы отсечь случайные всплески нагрузки
+RECHECKS = 2
+
+# Допуски: относительный и абсолютный (ниже абсолютного шум таймера и аллокатора)
+TIME_TOLERANCE = 0.25
+TIME_FLOOR_MS = 0.25
+ALLOC_TOLERANCE = 0.10
+ALLOC_FLOOR_KB = 16
+
+
+def build_cases(repository: CombinedRepository) -> dict:
+    """Случаи бенчмарка: идентификатор -> (аргументы calculate(), сбрасывать ли кэш путей)."""
+    cases = {}
+    for risk_profile in repository.get_strategy_profiles():
+        for num_months in TERMS_MONTHS:
+            if risk_profile == 'conservative' and num_months <= 12:
+                continue  # тот же расчет с подбором состава — случаи no-loss-search/* ниже
+            for contribution in CONTRIBUTIONS:
+                cases[f"{risk_profile}/{num_months}m/c{contribution}"] = (
+                    dict(risk_profile=risk_profile, amount=AMOUNT, term_months=num_months, monthly_contribution=contribution), False)
+
+    for num_months in NO_LOSS_TERMS_MONTHS:
+        for contribution in CONTRIBUTIONS:
+            cases[f"no-loss-search/{num_months}m/c{contribution}"] = (
+                dict(risk_profile='conservative', amount=AMOUNT, term_months=num_months, monthly_contribution=contribution), False)
+
+    # Ручная правка состава: самые доходные фонды каждого уровня риска
+    catalog = repository.get_catalog()
+    selected_funds = [funds[0]['name'] for funds in catalog.by_risk.values()]
+    for num_months in (36, 360):
+        cases[f"selected-funds/{num_months}m"] = (
+            dict(risk_profile='moderate', amount=AMOUNT, term_months=num_months, monthly_contribution=5000,
+                 selected_funds=selected_funds), False)
+
+    # Первый расчет профиля и срока: единичные пути еще не в кэше
+    for num_months in (60, 360):
+        cases[f"cold/aggressive/{num_months}m"] = (
+            dict(risk_profile='aggressive', amount=AMOUNT, term_months=num_months, monthly_contribution=10000), True)
+    return cases
+
+
+def run_case(calculator: PortfolioCalculator, kwargs: dict, cold: bool) -> dict:
+    """p50/p95 латентности (мс) и пик аллокаций (КБ) одного случая."""
+    def call():
+        if cold:
+            calculator._basis_cache.clear()
+        calculator.calculate(**kwargs)
+
+    call()  # прогрев
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    call()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": round(float(np.percentile(timings, 50)) * 1000, 4),
+        "p95_ms": round(float(np.percentile(timings, 95)) * 1000, 4),
+        "peak_alloc_kb": round(peak_bytes / 1024, 1),
+    }
+
+
+def find_regressions(current: dict, baseline: dict) -> list:
+    """Описания превышений допуска (пустой список — регрессий нет)."""
+    problems = []
+    limit_ms = max(baseline["p50_ms"] * (1 + TIME_TOLERANCE), baseline["p50_ms"] + TIME_FLOOR_MS)
+    if current["p50_ms"] > limit_ms:
+        problems.append(f"p50 {current['p50_ms']:.3f} мс > {limit_ms:.3f} мс")
+    limit_kb = max(baseline["peak_alloc_kb"] * (1 + ALLOC_TOLERANCE), baseline["peak_alloc_kb"] + ALLOC_FLOOR_KB)
+    if current["peak_alloc_kb"] > limit_kb:
+        problems.append(f"аллокации {current['peak_alloc_kb']:.0f} КБ > {limit_kb:.0f} КБ")
+    return problems
+
+
+def environment(calculator: PortfolioCalculator) -> dict:
+    """Параметры, при которых сравнение с базовой линией имеет смысл."""
+    return {
+        "num_simulations": calculator.num_simulations,
+        "sampling_method": calculator.sampling_method,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки PortfolioCalculator")
+    parser.add_argument('--update-baseline', action='store_true', help="записать результаты как новую базовую линию")
+    parser.add_argument('--filter', default='', help="запускать только случаи, в идентификаторе которых есть подстрока")
+    parser.add_argument('--allow-foreign-baseline', action='store_true',
+                        help="базовая линия из другого окружения: замерить без сравнения вместо ошибки")
+    args = parser.parse_args()
+
+    repository = CombinedRepository()
+    # Без кэша результатов и сетки: замеряется сам расчет
+    calculator = PortfolioCalculator(repository)
+    cases = {case_id: case for case_id, case in build_cases(repository).items() if args.filter in case_id}
+
+    baseline = None
+    if not args.update_baseline and os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("version") != BASELINE_VERSION or baseline.get("environment") != environment(calculator):
+            if not args.allow_foreign_baseline:
+                print("❌ Базовая линия снята в другом окружении или другой версии набора: обновите ее на этой "
+                      "машине (--update-baseline) или запустите с --allow-foreign-baseline.")
+                sys.exit(1)
+            print("⚠️ Базовая линия снята в другом окружении или другой версии набора: сравнение пропущено.")
+            baseline = None
+
+    print(f"{'случай':<36} {'p50, мс':>9} {'p95, мс':>9} {'аллок., КБ':>11} {'база p50':>9}  статус")
+    results, regressions = {}, {}
+    for case_id, (kwargs, cold) in cases.items():
+        if args.update_baseline:
+            # Базовая линия — медианный из нескольких прогонов, чтобы не зафиксировать выброс
+            runs = sorted((run_case(calculator, kwargs, cold) for _ in range(1 + RECHECKS)), key=lambda run: run["p50_ms"])
+            current = runs[len(runs) // 2]
+        else:
+            current = run_case(calculator, kwargs, cold)
+        results[case_id] = current
+        reference = (baseline or {}).get("cases", {}).get(case_id)
+        status, reference_p50 = "", ""
+        if reference:
+            reference_p50 = f"{reference['p50_ms']:.3f}"
+            problems = find_regressions(current, reference)
+            for _ in range(RECHECKS if problems else 0):
+                retry = run_case(calculator, kwargs, cold)
+                if retry["p50_ms"] < current["p50_ms"]:
+                    results[case_id] = current = retry
+                problems = find_regressions(current, reference)
+                if not problems:
+                    break
+            status = "РЕГРЕССИЯ: " + "; ".join(problems) if problems else "ok"
+            if problems:
+                regressions[case_id] = problems
+        elif baseline is not None:
+            status = "новый случай"
+        print(f"{case_id:<36} {current['p50_ms']:>9.3f} {current['p95_ms']:>9.3f} {current['peak_alloc_kb']:>11.1f} {reference_p50:>9}  {status}")
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({"version": BASELINE_VERSION, "environment": environment(calculator), "cases": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Базовая линия сохранена в {BASELINE_PATH}")
+    elif regressions:
+        print(f"❌ Регрессии в {len(regressions)} случа(ях) из {len(cases)}.")
+        sys.exit(1)
+    elif baseline is not None:
+        print(f"✅ Все {len(cases)} случа(ев) в пределах допуска.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/forecast_memory.py
+# Сравнение режимов прогноза 'matrix', 'streaming' и 'basis' по памяти и времени.
+# Для 'basis' замеряется установившийся режим: единичные пути уже в кэше после прогрева.
+# Запуск из корня проекта:  python -m benchmarks.forecast_memory
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from portfolio_bot.domain.calculator import PortfolioCalculator
+
+TERMS_MONTHS = [12, 120, 360]
+MODES = ['matrix', 'streaming', 'basis']
+REPEATS = 20
+
+
+def run_case(mode: str, num_months: int) -> dict:
+    """Замеряет один режим на одном сроке: латентность и пик аллокаций NumPy."""
+    calculator = PortfolioCalculator(repository=None)
+    forecast = lambda: calculator._generate_forecast_monte_carlo(
+        100000, num_months, 15.0, 20.0, 10000, 'moderate', forecast_mode=mode,
+        seed_key=('moderate', num_months)
+    )
+    forecast()  # прогрев
+
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        forecast()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    forecast()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": np.percentile(timings, 50) * 1000,
+        "p95_ms": np.percentile(timings, 95) * 1000,
+        "peak_alloc_mb": peak_bytes / 2**20,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    # Каждый случай в отдельном процессе, иначе ru_maxrss накапливается между замерами
+    if len(sys.argv) == 3:
+        result = run_case(sys.argv[1], int(sys.argv[2]))
+        print(" ".join(f"{value:.3f}" for value in result.values()))
+        return
+
+    print(f"{'срок':>6} {'режим':>10} {'p50, мс':>9} {'p95, мс':>9} {'пик аллок., МБ':>15} {'max RSS, МБ':>12}")
+    for num_months in TERMS_MONTHS:
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.forecast_memory", mode, str(num_months)],
+                capture_output=True, text=True, check=True
+            ).stdout.split()
+            p50, p95, peak, rss = (float(value) for value in output[-4:])
+            print(f"{num_months:>6} {mode:>10} {p50:>9.2f} {p95:>9.2f} {peak:>15.2f} {rss:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
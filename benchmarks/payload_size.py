@@ -0,0 +1,57 @@
+# benchmarks/payload_size.py
+# Размер и время сериализации ответа /api/calculate: полный формат против
+# компактного (fixed/delta/f32), без сжатия и с gzip, для разных сроков.
+# Запуск из корня проекта:  python -m benchmarks.payload_size
+import contextlib
+import gzip
+import io
+import time
+
+import numpy as np
+
+from portfolio_bot import codec
+from portfolio_bot.database.repository import CombinedRepository
+from portfolio_bot.domain.calculator import PortfolioCalculator
+from portfolio_bot.domain.compact_payload import ENCODINGS, compact_result, decode_series
+
+TERMS_MONTHS = [12, 60, 120, 360]
+AMOUNT = 100000
+MONTHLY_CONTRIBUTION = 10000
+SERIALIZE_REPEATS = 200
+
+
+def measure(payload_builder) -> tuple:
+    """Размер JSON, размер после gzip (в байтах) и время построения + сериализации (мс) через codec."""
+    started = time.perf_counter()
+    for _ in range(SERIALIZE_REPEATS):
+        body = codec.dumps(payload_builder())
+    elapsed_ms = (time.perf_counter() - started) / SERIALIZE_REPEATS * 1000
+    return len(body), len(gzip.compress(body)), elapsed_ms
+
+
+def max_error(result: dict, compact: dict, encoding: str) -> float:
+    """Максимальная абсолютная ошибка (в рублях) восстановленного forecast.avg."""
+    restored = decode_series(compact["forecast"]["avg"], encoding)
+    return float(np.max(np.abs(np.asarray(restored) - result["forecast"]["avg"])))
+
+
+def main():
+    repository = CombinedRepository()
+    calculator = PortfolioCalculator(repository)
+    catalog = repository.get_catalog()
+    print(f"{'срок':>5} {'формат':>8} {'JSON, Б':>9} {'gzip, Б':>8} {'сериализация, мс':>17} {'ошибка, ₽':>10}")
+
+    for num_months in TERMS_MONTHS:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = calculator.calculate('aggressive', AMOUNT, term_months=num_months, monthly_contribution=MONTHLY_CONTRIBUTION)
+
+        size, gzip_size, elapsed_ms = measure(lambda: result)
+        print(f"{num_months:>5} {'full':>8} {size:>9} {gzip_size:>8} {elapsed_ms:>17.3f} {'':>10}")
+        for encoding in ENCODINGS:
+            size, gzip_size, elapsed_ms = measure(lambda: compact_result(result, catalog, encoding))
+            error = max_error(result, compact_result(result, catalog, encoding), encoding)
+            print(f"{num_months:>5} {encoding:>8} {size:>9} {gzip_size:>8} {elapsed_ms:>17.3f} {error:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# benchmarks/sampling_error.py
+# Стандартная ошибка перцентилей 5/15/85/95 и среднего на конец срока для разных
+# способов генерации шоков и числа путей. Ошибка оценивается по разбросу между
+# независимыми повторами (разные зерна).
+# Запуск из корня проекта:  python -m benchmarks.sampling_error
+import time
+
+import numpy as np
+
+from portfolio_bot.domain.calculator import PortfolioCalculator, qmc
+
+SAMPLE_COUNTS = [256, 512, 1024, 2048]
+METHODS = ['pseudo', 'antithetic', 'sobol']
+PERCENTILES = [5, 15, 85, 95]
+REPEATS = 200
+# Типичный "тяжелый" сценарий: агрессивная стратегия, 5 лет, с пополнениями
+ANNUAL_RETURN, ANNUAL_VOLATILITY = 25.7, 19.9
+NUM_MONTHS, AMOUNT, MONTHLY_CONTRIBUTION = 60, 100000, 10000
+
+
+def measure(method: str, num_simulations: int) -> tuple:
+    """Относительные стандартные ошибки (в %) [p5, p15, p85, p95, mean] и время одного прогона."""
+    calculator = PortfolioCalculator(repository=None, num_simulations=num_simulations, sampling_method=method)
+    monthly_return, monthly_volatility = calculator._monthly_parameters(ANNUAL_RETURN, ANNUAL_VOLATILITY)
+
+    estimates = []
+    started = time.perf_counter()
+    for repeat in range(REPEATS):
+        random_shocks = calculator._draw_shocks(calculator._make_rng('sampling-error', repeat), NUM_MONTHS)
+        final_capital = calculator._advance_paths(AMOUNT, MONTHLY_CONTRIBUTION, monthly_return, monthly_volatility,
+                                                  random_shocks, first_month=True)[-1]
+        estimates.append(np.append(np.percentile(final_capital, PERCENTILES), final_capital.mean()))
+    elapsed_ms = (time.perf_counter() - started) / REPEATS * 1000
+
+    estimates = np.array(estimates)
+    return 100 * estimates.std(axis=0, ddof=1) / estimates.mean(axis=0), elapsed_ms
+
+
+def main():
+    methods = METHODS if qmc is not None else [m for m in METHODS if m != 'sobol']
+    header = " ".join(f"{'p' + str(q) + ', %':>8}" for q in PERCENTILES)
+    print(f"{'способ':>11} {'путей':>6} {header} {'mean, %':>8} {'мс':>6}")
+
+    for method in methods:
+        for num_simulations in SAMPLE_COUNTS:
+            errors, elapsed_ms = measure(method, num_simulations)
+            values = " ".join(f"{error:>8.3f}" for error in errors)
+            print(f"{method:>11} {num_simulations:>6} {values} {elapsed_ms:>6.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# loadtest/bot_stub.py
+# Заглушка внутреннего эндпоинта бота /send_portfolio (см. main.py) для нагрузочных тестов:
+# api_server.py пересылает туда /api/notify, а настоящий бот отправил бы сообщение в Telegram.
+# Заглушка проверяет тело запроса так же, как бот, и отвечает после задержки,
+# имитирующей вызов Telegram Bot API.
+#
+# Запуск из корня проекта:  python -m loadtest.bot_stub [--port 8080] [--delay-ms 150]
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8080
+DEFAULT_DELAY_MS = 150
+
+
+class SendPortfolioStub(BaseHTTPRequestHandler):
+    delay_seconds = DEFAULT_DELAY_MS / 1000
+    received = 0
+    duplicates = 0
+    keys = set()
+    keys_lock = threading.Lock()
+
+    def do_POST(self):
+        if self.path != '/send_portfolio':
+            self._reply(404, {"error": "Not found"})
+            return
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except json.JSONDecodeError:
+            self._reply(400, {"error": "Некорректный JSON"})
+            return
+        if not data.get('userId') or not data.get('portfolioSummary'):
+            self._reply(400, {"error": "Missing userId or portfolioSummary"})
+            return
+        # Как бот: повтор уже принятого уведомления не отправляется второй раз
+        key = self.headers.get('Idempotency-Key')
+        with SendPortfolioStub.keys_lock:
+            duplicate = bool(key) and key in SendPortfolioStub.keys
+            SendPortfolioStub.keys.add(key)
+        if duplicate:
+            SendPortfolioStub.duplicates += 1
+            self._reply(200, {"status": "already sent"})
+            return
+
+        time.sleep(self.delay_seconds)
+        SendPortfolioStub.received += 1
+        self._reply(200, {"status": "ok"})
+
+    def _reply(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Лог каждого запроса под нагрузкой только мешает
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка /send_portfolio бота")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--delay-ms', type=float, default=DEFAULT_DELAY_MS)
+    args = parser.parse_args()
+
+    SendPortfolioStub.delay_seconds = args.delay_ms / 1000
+    # Очередь соединений по умолчанию (5) переполняется уже при десятках одновременных уведомлений
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), SendPortfolioStub)
+    print(f"[ЗАГЛУШКА БОТА] Слушаю http://127.0.0.1:{args.port}/send_portfolio (задержка {args.delay_ms:.0f} мс)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"[ЗАГЛУШКА БОТА] Принято уведомлений: {SendPortfolioStub.received}, "
+              f"повторов без отправки: {SendPortfolioStub.duplicates}")
+
+
+if __name__ == '__main__':
+    main()
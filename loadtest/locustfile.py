@@ -0,0 +1,118 @@
+# loadtest/locustfile.py
+# Нагрузочный тест с реалистичной смесью трафика: пользователи проходят пути,
+# выведенные из записанных продуктовых событий (см. traffic_model.py), с
+# записанными паузами между действиями. Каждая страница тянет статику по ссылкам
+# из отданного сервером HTML, то есть по адресам с хэшем (один раз за сессию,
+# дальше — кэш браузера), ползунки пересчитывают прогноз теми же эндпоинтами,
+# что и фронтенд (поток, пакет или обычный расчет), подтверждение портфеля
+# отправляет /api/notify.
+#
+# Запуск из корня проекта (три терминала):
+#     python -m loadtest.bot_stub                       # заглушка /send_portfolio на :8080
+#     python -m portfolio_bot.api_server                # API на :5001
+#     locust -f loadtest/locustfile.py --host http://127.0.0.1:5001 --headless -u 50 -r 5 -t 5m --csv loadtest/report
+# Locust считает RPS и перцентили задержек по каждому эндпоинту (имена запросов ниже);
+# с --csv они сохраняются в loadtest/report_stats.csv.
+# THINK_TIME_SCALE < 1 сжимает записанные паузы, чтобы меньшим числом пользователей
+# получить ту же нагрузку.
+import json
+import os
+import random
+
+import gevent
+from locust import HttpUser, between, task
+
+from traffic_model import EVENT_REQUESTS, TrafficModel, linked_assets
+
+THINK_TIME_SCALE = float(os.environ.get('THINK_TIME_SCALE', 1.0))
+
+MODEL = TrafficModel.load()
+
+
+class JourneyUser(HttpUser):
+    # Пауза между сессиями одного пользователя
+    wait_time = between(5, 30)
+
+    def on_start(self):
+        self.rng = random.Random()
+
+    @task
+    def journey(self):
+        loaded_assets = set()
+        payload = MODEL.sample_payload(self.rng)
+        last_result = None
+
+        for state, think_time in MODEL.sample_journey(self.rng, THINK_TIME_SCALE):
+            for request in EVENT_REQUESTS.get(state, ()):
+                kind = request[0]
+                if kind == 'page':
+                    self.load_page(request[1], loaded_assets)
+                elif kind == 'funds':
+                    self.client.get('/api/funds', name='/api/funds')
+                elif kind in ('calculate', 'stream', 'batch'):
+                    MODEL.resample_field(self.rng, payload, request[1])
+                    if kind == 'batch' and payload.get('monthlyContribution'):
+                        last_result = self.calculate_batch(payload) or last_result
+                    elif kind == 'calculate':
+                        last_result = self.calculate(payload) or last_result
+                    else:
+                        last_result = self.calculate_stream(payload) or last_result
+                elif kind == 'notify' and last_result is not None:
+                    self.notify(payload, last_result)
+            gevent.sleep(think_time)
+
+    def load_page(self, page: str, loaded_assets: set):
+        response = self.client.get(f'/{page}', name='page')
+        queue = linked_assets(page, response.text) if response.ok else []
+        while queue:
+            asset = queue.pop(0)
+            if asset in loaded_assets:
+                continue
+            loaded_assets.add(asset)
+            response = self.client.get(f'/{asset}', name='static')
+            if asset.endswith('.js') and response.ok:
+                queue.extend(linked_assets(asset, response.text))
+
+    def calculate(self, payload: dict):
+        with self.client.post('/api/calculate', json=payload, name='/api/calculate', catch_response=True) as response:
+            if response.status_code != 200:
+                response.failure(f"HTTP {response.status_code}")
+                return None
+            return response.json()
+
+    def calculate_batch(self, payload: dict):
+        # Как шаг пополнений в auto-selection.js: прогноз с пополнением и без на общих шоках
+        scenarios = [payload, {**payload, "monthlyContribution": 0}]
+        with self.client.post('/api/calculate/batch', json={"scenarios": scenarios}, name='/api/calculate/batch',
+                              catch_response=True) as response:
+            if response.status_code != 200:
+                response.failure(f"HTTP {response.status_code}")
+                return None
+            return response.json()['results'][0]
+
+    def calculate_stream(self, payload: dict):
+        # Как fetchProgressive: NDJSON дочитывается до полного результата
+        with self.client.post('/api/calculate/stream', json=payload, name='/api/calculate/stream',
+                              catch_response=True) as response:
+            if response.status_code != 200:
+                response.failure(f"HTTP {response.status_code}")
+                return None
+            messages = [json.loads(line) for line in response.text.splitlines() if line]
+            if not messages or messages[-1].get('event') != 'result':
+                response.failure(messages[-1].get('error', "поток оборвался") if messages else "пустой поток")
+                return None
+            return messages[-1]['result']
+
+    def notify(self, payload: dict, result: dict):
+        # Как confirm-portfolio.js: от прогноза остаются только последние точки
+        forecast = result.get('forecast', {})
+        lean_result = {
+            **result,
+            "forecast": {band: forecast.get(band, [])[-1:] for band in ('min', 'avg', 'max')},
+            "deposit_forecast": None,
+            "monthly_income_forecast": (result.get('monthly_income_forecast') or [])[-1:],
+        }
+        self.client.post('/api/notify', name='/api/notify', json={
+            "userId": self.rng.randint(10**8, 10**10),
+            "portfolioSummary": {"investmentData": payload, "portfolioData": lean_result}
+        })
@@ -0,0 +1,230 @@
+# loadtest/traffic_model.py
+# Модель трафика мини-приложения, выведенная из записанных продуктовых событий
+# (Analyzer/events_dump.json).
+#
+# События каждого пользователя режутся на сессии (пауза больше SESSION_GAP_MINUTES),
+# и по сессиям строится марковская цепь: вероятность первого события, переходов
+# между событиями и выхода, а также эмпирические паузы "подумать" после каждого
+# события. Какие HTTP-запросы порождает событие, описывает EVENT_REQUESTS —
+# это повторяет то, что делает фронтенд (portfolio_mini_app/js): автоподбор считает
+# прогноз потоком (/api/calculate/stream), шаг пополнений — пакетом из двух сценариев
+# (/api/calculate/batch), страницы портфеля и его правки — обычным /api/calculate.
+#
+# Сводка модели:  python -m loadtest.traffic_model
+import json
+import os
+import posixpath
+import random
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+EVENTS_PATH = os.path.join(ROOT_DIR, 'Analyzer', 'events_dump.json')
+
+SESSION_GAP_MINUTES = 30
+MAX_THINK_SECONDS = 60.0
+MAX_JOURNEY_STEPS = 200
+EXIT = '__exit__'
+
+# Шаги автоподбора, на которых фронтенд пересчитывает прогноз (см. makeApiCallAndUpdateChart
+# в auto-selection.js); на шаге пополнений прогнозы с пополнением и без идут одним пакетом
+CALCULATING_STEPS = ('step-grow-term', 'step-dream-term', 'step-passive-term', 'step-risk', 'step-contribution')
+CONTRIBUTION_STEP = 'step-contribution'
+# Поле ввода автоподбора (elementId события) -> поле расчета, которое оно меняет
+INPUT_FIELDS = {
+    'contribution-slider': 'monthlyContribution',
+    'term-grow': 'term_months',
+    'term-dream': 'term_months',
+    'term-passive': 'term_months',
+    'amount-grow': 'amount',
+    'initial-amount-dream': 'amount',
+    'initial-amount-passive': 'amount',
+    'amount-dream': 'dreamAmount',
+    'income-passive': 'passiveIncome',
+}
+# События, состояние которых уточняется полем eventData: шаг автоподбора или поле ввода
+STATE_DETAILS = {
+    'auto_selection_step_completed': 'step',
+    'slider_changed': 'elementId',
+    'input_number_changed': 'elementId',
+}
+
+# Событие -> запросы, которые фронтенд делает рядом с ним:
+#   ('page', файл) — HTML страницы и ее статика; ('calculate', поле) — /api/calculate
+#   с измененным полем (None — без изменений); ('stream', поле) — /api/calculate/stream;
+#   ('batch', поле) — /api/calculate/batch с пополнением и без (при нулевом пополнении
+#   фронтенд вместо пакета делает потоковый расчет); ('funds',) — /api/funds; ('notify',) — /api/notify
+EVENT_REQUESTS = {
+    'page_view_main': [('page', 'index.html')],
+    'page_view_auto_selection': [('page', 'auto-selection.html')],
+    'page_view_loading': [('page', 'loading.html')],
+    'page_view_portfolio': [('page', 'portfolio.html'), ('calculate', None)],
+    'page_view_edit_portfolio': [('page', 'edit-portfolio.html'), ('funds',), ('calculate', None)],
+    'page_view_confirm_portfolio': [('page', 'confirm-portfolio.html')],
+    'page_view_final': [('page', 'final.html')],
+    'auto_selection_risk_selected': [('stream', 'riskProfile')],
+    'risk_slider_used': [('calculate', 'riskProfile')],
+    'term_slider_used': [('calculate', 'term_months')],
+    'contribution_slider_used': [('calculate', 'monthlyContribution')],
+    'asset_replaced': [('calculate', None)],
+    'click_reset_portfolio_edit': [('calculate', None)],
+    'click_confirm_on_confirm_page': [('notify',)],
+}
+for _step in CALCULATING_STEPS:
+    EVENT_REQUESTS[f'auto_selection_step_completed:{_step}'] = [('batch' if _step == CONTRIBUTION_STEP else 'stream', None)]
+for _element, _field in INPUT_FIELDS.items():
+    # Ползунок пополнения стоит на шаге пополнений, остальные поля — на шагах с потоковым расчетом
+    _kind = 'batch' if _field == 'monthlyContribution' else 'stream'
+    for _name in ('slider_changed', 'input_number_changed'):
+        EVENT_REQUESTS[f'{_name}:{_element}'] = [(_kind, _field)]
+
+
+def event_state(event: dict) -> str:
+    """Состояние цепи для события: шаги автоподбора и поля ввода различаются по eventData."""
+    name = event['eventName']
+    detail = (event.get('eventData') or {}).get(STATE_DETAILS.get(name))
+    return f"{name}:{detail}" if detail else name
+
+
+def split_sessions(events: list) -> list:
+    """Сессии пользователей: списки (время, состояние) в хронологическом порядке."""
+    by_user = defaultdict(list)
+    for event in events:
+        if event.get('userId') in (None, 'unknown_user'):
+            continue
+        try:
+            timestamp = datetime.fromisoformat(event['timestamp'])
+        except (KeyError, ValueError):
+            continue
+        by_user[event['userId']].append((timestamp, event_state(event)))
+
+    sessions = []
+    for user_events in by_user.values():
+        user_events.sort(key=lambda item: item[0])
+        current = [user_events[0]]
+        for previous, item in zip(user_events, user_events[1:]):
+            if (item[0] - previous[0]).total_seconds() > SESSION_GAP_MINUTES * 60:
+                sessions.append(current)
+                current = []
+            current.append(item)
+        sessions.append(current)
+    return sessions
+
+
+class TrafficModel:
+    """Марковская цепь пользовательских путей с эмпирическими паузами и параметрами расчетов."""
+
+    def __init__(self, start: dict, transitions: dict, think_times: dict, payloads: list, field_values: dict):
+        self.start = start                # состояние -> вероятность начать с него сессию
+        self.transitions = transitions    # состояние -> {следующее состояние или EXIT: вероятность}
+        self.think_times = think_times    # состояние -> паузы после события, в секундах
+        self.payloads = payloads          # записанные параметры расчетов (confirm_all_and_build)
+        self.field_values = field_values  # поле расчета -> наблюдавшиеся значения
+
+    @classmethod
+    def from_events(cls, events: list):
+        sessions = split_sessions(events)
+        start_counts = Counter(session[0][1] for session in sessions)
+        transition_counts = defaultdict(Counter)
+        think_times = defaultdict(list)
+        for session in sessions:
+            for (time_from, state), (time_to, next_state) in zip(session, session[1:]):
+                transition_counts[state][next_state] += 1
+                think_times[state].append(min((time_to - time_from).total_seconds(), MAX_THINK_SECONDS))
+            transition_counts[session[-1][1]][EXIT] += 1
+
+        payloads = [
+            {key: value for key, value in event['eventData'].items() if value is not None}
+            for event in events
+            if event['eventName'] == 'confirm_all_and_build' and event.get('eventData', {}).get('riskProfile')
+        ]
+        field_values = defaultdict(list)
+        for payload in payloads:
+            for field, value in payload.items():
+                field_values[field].append(value)
+
+        return cls(
+            start=_normalize(start_counts),
+            transitions={state: _normalize(counts) for state, counts in transition_counts.items()},
+            think_times=dict(think_times),
+            payloads=payloads,
+            field_values=dict(field_values)
+        )
+
+    @classmethod
+    def load(cls, path: str = EVENTS_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_events(json.load(f))
+
+    def sample_journey(self, rng: random.Random, think_time_scale: float = 1.0):
+        """Генерирует путь одной сессии: пары (состояние, пауза после него в секундах)."""
+        state = _choose(rng, self.start)
+        for _ in range(MAX_JOURNEY_STEPS):
+            samples = self.think_times.get(state)
+            think_time = rng.choice(samples) * think_time_scale if samples else 0.0
+            yield state, think_time
+            state = _choose(rng, self.transitions.get(state, {EXIT: 1.0}))
+            if state == EXIT:
+                return
+
+    def sample_payload(self, rng: random.Random) -> dict:
+        """Начальные параметры расчета для новой сессии (копия записанного запроса)."""
+        return dict(rng.choice(self.payloads))
+
+    def resample_field(self, rng: random.Random, payload: dict, field: str):
+        """Меняет одно поле расчета так, как его меняют ползунки (значение из записанных)."""
+        if field and self.field_values.get(field):
+            payload[field] = rng.choice(self.field_values[field])
+
+    def request_mix(self, num_journeys: int = 10000, seed: int = 0) -> Counter:
+        """Ожидаемое число запросов каждого вида на num_journeys сессий."""
+        rng = random.Random(seed)
+        mix = Counter()
+        for _ in range(num_journeys):
+            for state, _ in self.sample_journey(rng):
+                for request in EVENT_REQUESTS.get(state, ()):
+                    mix[request[0]] += 1
+        return mix
+
+
+# Ссылки страницы (src/href) и ES-импорты модулей: внешние адреса и якоря не учитываются
+_PAGE_LINK_RE = re.compile(r'(?:src|href)="([^"?#:]+)"')
+_MODULE_IMPORT_RE = re.compile(r'''from\s+['"](\.{1,2}/[^'"]+)['"]''')
+
+
+def linked_assets(path: str, body: str) -> list:
+    """
+    Адреса статики, которые браузер загрузит вслед за файлом path с содержимым body:
+    src/href страницы или ES-импорты JS-модуля. Для страниц берется HTML в том виде,
+    в каком его отдает сервер, то есть со ссылками на адреса с хэшем содержимого.
+    """
+    pattern = _MODULE_IMPORT_RE if path.endswith('.js') else _PAGE_LINK_RE
+    assets = []
+    for link in pattern.findall(body):
+        asset = posixpath.normpath(posixpath.join(posixpath.dirname(path), link)).lstrip('/')
+        if asset not in assets and not asset.endswith('.html'):
+            assets.append(asset)
+    return assets
+
+
+def _normalize(counts: Counter) -> dict:
+    total = sum(counts.values())
+    return {key: count / total for key, count in counts.items()}
+
+
+def _choose(rng: random.Random, probabilities: dict):
+    return rng.choices(list(probabilities), weights=list(probabilities.values()))[0]
+
+
+if __name__ == '__main__':
+    model = TrafficModel.load()
+    print(f"Состояний: {len(model.transitions)}, записанных расчетов: {len(model.payloads)}")
+    print("Первое событие сессии:")
+    for state, probability in sorted(model.start.items(), key=lambda item: -item[1])[:5]:
+        print(f"  {state:<50} {probability:6.1%}")
+    mix = model.request_mix()
+    total = sum(mix.values())
+    print("Доля запросов по видам:")
+    for kind, count in mix.most_common():
+        print(f"  {kind:<12} {count / total:6.1%}")
@@ -4,12 +4,12 @@
 import telebot
 import firebase_admin
 from firebase_admin import credentials, firestore
-import json
-from threading import Thread
+from collections import OrderedDict
+from threading import Lock, Thread
 from flask import Flask, request
 
 # --- Импорты из нашего пакета portfolio_bot ---
-from portfolio_bot import config
+from portfolio_bot import codec, config
 from portfolio_bot.database.repository import CombinedRepository
 from portfolio_bot.domain.calculator import PortfolioCalculator
 from portfolio_bot.handlers.start import register_start_handler
@@ -153,7 +153,7 @@ def format_and_send_portfolio(user_id, final_data):
 # --- Обработчик для Web App Data (старый, остается для обратной совместимости) ---
 @bot.message_handler(content_types=['web_app_data'])
 def handle_web_app_data(message):
-    final_data = json.loads(message.web_app_data.data)
+    final_data = codec.loads(message.web_app_data.data)
     format_and_send_portfolio(message.chat.id, final_data)
 
 # --- Регистрация команд бота ---
@@ -165,21 +165,47 @@ print("Обработчики команд зарегистрированы.")
 # --- ВНУТРЕННИЙ СЕРВЕР ДЛЯ ПРИЕМА ЗАПРОСОВ ОТ API_SERVER ---
 internal_app = Flask(__name__)
 
+# Ключи уведомлений (заголовок Idempotency-Key от portfolio_bot/notifier.py), по которым
+# отправка уже начиналась: повтор той же доставки не шлет пользователю второе сообщение
+NOTIFICATION_KEYS_LIMIT = 10000
+claimed_notification_keys = OrderedDict()
+notification_keys_lock = Lock()
+
+def claim_notification(key):
+    """True, если уведомление с этим ключом пришло впервые (без ключа — всегда True)."""
+    if not key:
+        return True
+    with notification_keys_lock:
+        if key in claimed_notification_keys:
+            return False
+        claimed_notification_keys[key] = True
+        while len(claimed_notification_keys) > NOTIFICATION_KEYS_LIMIT:
+            claimed_notification_keys.popitem(last=False)
+    return True
+
 @internal_app.route('/send_portfolio', methods=['POST'])
 def send_portfolio_from_api():
+    # 5xx notifier повторит, поэтому такой ответ допустим только до начала отправки
     try:
-        data = request.json
+        data = codec.loads(request.get_data())
         user_id = data.get('userId')
         portfolio_summary = data.get('portfolioSummary')
         if not user_id or not portfolio_summary:
             return "Missing data", 400
-        
-        format_and_send_portfolio(user_id, portfolio_summary)
-        return "OK", 200
+        if not claim_notification(request.headers.get('Idempotency-Key')):
+            return "Already sent", 200
     except Exception as e:
         print(f"Ошибка в /send_portfolio: {e}")
         return "Internal Server Error", 500
 
+    try:
+        format_and_send_portfolio(user_id, portfolio_summary)
+    except Exception as e:
+        # Сообщение могло уйти: повтор прислал бы дубль, поэтому ответ не из 5xx
+        print(f"Ошибка отправки в /send_portfolio: {e}")
+        return "Send attempted", 409
+    return "OK", 200
+
 # --- Запуск бота и сервера ---
 if __name__ == '__main__':
     print("Запускаем внутренний сервер для API в отдельном потоке...")
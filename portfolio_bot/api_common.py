@@ -0,0 +1,241 @@
+# portfolio_bot/api_common.py
+# Общая часть HTTP-серверов API: Flask (api_server.py) и ASGI (asgi_server.py)
+# поднимают одинаковый бэкенд расчетов и одинаково разбирают и форматируют запросы.
+import os
+
+from portfolio_bot import codec
+from portfolio_bot.database.repository import CombinedRepository
+from portfolio_bot.domain.calculator import PortfolioCalculator
+from portfolio_bot.domain.forecast_cache import ForecastCache
+from portfolio_bot.domain.forecast_grid import ForecastGrid
+from portfolio_bot.domain.executor import CalculationExecutor, CalculationTimeout
+from portfolio_bot.codec import RequestValidationError
+from portfolio_bot.domain.compact_payload import DEFAULT_ENCODING, ENCODINGS, compact_result
+from portfolio_bot.domain.metrics import METRICS
+from portfolio_bot.notifier import BotNotifier, NotificationRejected
+from portfolio_bot.static_assets import IMMUTABLE_CACHE_CONTROL, StaticAsset
+
+# Папка с фронтендом мини-приложения
+STATIC_FOLDER_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'portfolio_mini_app'))
+# Внутренний эндпоинт бота (main.py), который отправляет портфель пользователю в Telegram
+BOT_NOTIFY_URL = os.environ.get('BOT_NOTIFY_URL', 'http://127.0.0.1:8080/send_portfolio')
+# Сколько вариантов ответа /api/funds (проекция полей x фильтр по риску) держать готовыми
+FUNDS_BODY_CACHE_SIZE = 64
+# Список без ?version= каждый раз перепроверяется по ETag: после обновления каталога
+# клиент сразу получает новые фонды (на них ссылаются компактные ответы)
+FUNDS_CACHE_CONTROL = 'no-cache'
+# Форматы потокового расчета (/api/calculate/stream): NDJSON по умолчанию, SSE по Accept
+STREAM_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream; charset=utf-8',
+}
+# Потоковый ответ нельзя кэшировать и буферизовать на прокси (nginx)
+STREAM_HEADERS = [('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')]
+# Поля ForecastCache.stats(), которые только растут (экспортируются как counter с суффиксом _total)
+CACHE_COUNTER_STATS = ('hits', 'misses', 'evictions')
+
+METRICS.describe('portfolio_http_requests_total', 'Число HTTP-запросов к API по эндпоинту и коду ответа')
+METRICS.describe('portfolio_http_errors_total', 'Число ответов API с кодом 5xx')
+METRICS.describe('portfolio_http_request_duration_seconds', 'Время обработки HTTP-запроса к API')
+METRICS.describe('portfolio_forecast_cache_hits_total', 'Число попаданий в кэш результатов расчета')
+METRICS.describe('portfolio_forecast_cache_misses_total', 'Число промахов кэша результатов расчета')
+METRICS.describe('portfolio_forecast_cache_evictions_total', 'Число записей, вытесненных из кэша результатов расчета')
+
+
+def build_backend(default_backend: str = 'inline') -> tuple:
+    """
+    Репозиторий, калькулятор и исполнитель расчетов по переменным окружения
+    CALCULATION_BACKEND / _WORKERS / _QUEUE_SIZE / _TIMEOUT / _DEGRADE (см. CalculationExecutor).
+
+    Под pre-fork сервером (API_PREFORK=1, см. gunicorn_conf.py) функция вызывается один раз
+    в мастер-процессе: каталог и сетка загружаются до fork и делятся воркерами
+    copy-on-write, а пулы расчетов поднимаются уже в воркерах (post_fork).
+    """
+    repository = CombinedRepository()
+    # Снимок каталога строится сразу, а не на первом запросе
+    repository.get_catalog()
+    # Сетка открывается через mmap: все воркеры делят одну копию через page cache.
+    # Собирает ее шаг деплоя (python -m portfolio_bot.domain.forecast_grid), не сервер
+    forecast_grid = ForecastGrid.load(catalog_version=repository.get_catalog_version())
+    calculator = PortfolioCalculator(repository, cache=ForecastCache(), grid=forecast_grid)
+    executor = CalculationExecutor(
+        calculator,
+        backend=os.environ.get('CALCULATION_BACKEND', default_backend),
+        max_workers=int(os.environ.get('CALCULATION_WORKERS', 0)) or None,
+        queue_size=int(os.environ.get('CALCULATION_QUEUE_SIZE', 64)),
+        task_timeout=float(os.environ.get('CALCULATION_TIMEOUT', 10)),
+        degrade=os.environ.get('CALCULATION_DEGRADE', '1') == '1'
+    )
+    if os.environ.get('API_PREFORK') != '1':
+        executor.warm_up()
+    return repository, calculator, executor
+
+
+def build_notifier() -> BotNotifier:
+    """Очередь уведомлений боту по переменным окружения NOTIFY_* (см. notifier.py)."""
+    return BotNotifier.from_env(BOT_NOTIFY_URL)
+
+
+def enqueue_notification(notifier: BotNotifier, data) -> tuple:
+    """
+    (тело, статус) ответа /api/notify. Запрос проверяется так же, как это делает бот,
+    и ставится в очередь: ответ 202 не ждет отправки сообщения в Telegram.
+    """
+    if not isinstance(data, dict) or not data.get('userId') or not data.get('portfolioSummary'):
+        return {"error": "Missing userId or portfolioSummary"}, 400
+    try:
+        notifier.enqueue(data)
+    except NotificationRejected:
+        return {"error": "Очередь уведомлений переполнена, попробуйте позже"}, 503
+    return {"status": "queued"}, 202
+
+
+# Допустимые значения ?format= (без параметра — полный ответ)
+RESULT_FORMATS = ('full', 'compact')
+
+
+def check_result_format(query_args):
+    """
+    Проверяет ?format= и ?encoding= до расчета: ошибка в них — RequestValidationError
+    (ответ 400), а не сбой при форматировании уже посчитанного результата.
+    """
+    result_format = query_args.get('format')
+    if result_format is not None and result_format not in RESULT_FORMATS:
+        raise RequestValidationError(f"Параметр format: ожидается одно из: {', '.join(RESULT_FORMATS)}")
+    encoding = query_args.get('encoding')
+    if encoding is not None and encoding not in ENCODINGS:
+        raise RequestValidationError(f"Параметр encoding: ожидается одно из: {', '.join(ENCODINGS)}")
+
+
+def format_result(result: dict, query_args, repository: CombinedRepository) -> dict:
+    """
+    Полный ответ по умолчанию; компактный (см. compact_payload) при ?format=compact.
+    Способ кодирования рядов: ?encoding=fixed|delta|f32. Параметры проверяет check_result_format.
+    """
+    if query_args.get('format') != 'compact':
+        return result
+    return compact_result(result, repository.get_catalog(), query_args.get('encoding', DEFAULT_ENCODING))
+
+
+def stream_format(accept: str) -> str:
+    """'sse', если клиент просит text/event-stream (EventSource), иначе 'ndjson'."""
+    return 'sse' if 'text/event-stream' in (accept or '') else 'ndjson'
+
+
+def stream_headers(stream_format_name: str) -> list:
+    return [('Content-Type', STREAM_CONTENT_TYPES[stream_format_name])] + STREAM_HEADERS
+
+
+def _stream_message(stream_format_name: str, event: str, data: dict) -> bytes:
+    if stream_format_name == 'sse':
+        return b'event: ' + event.encode() + b'\ndata: ' + codec.dumps(data) + b'\n\n'
+    return codec.dumps({"event": event, **data}) + b'\n'
+
+
+def stream_event(stream_format_name: str, step: tuple, query_args, repository: CombinedRepository) -> bytes:
+    """
+    Один шаг потокового расчета (событие, число путей, результат) в формате потока:
+      NDJSON — строка {"event": "estimate"|"result", "paths": N, "result": {...}};
+      SSE    — "event: estimate|result" и "data: {"paths": N, "result": {...}}".
+    Результат форматируется так же, как у /api/calculate (в т.ч. ?format=compact).
+    """
+    event, num_simulations, result = step
+    return _stream_message(stream_format_name, event,
+                           {"paths": num_simulations, "result": format_result(result, query_args, repository)})
+
+
+def stream_error(stream_format_name: str, error: Exception, endpoint_path: str) -> bytes:
+    """Последнее событие потока, если расчет прервался после отправки заголовков."""
+    if isinstance(error, CalculationTimeout):
+        message = "Расчет занял слишком много времени"
+    else:
+        print(f"Произошла ошибка в {endpoint_path}: {error}")
+        message = "Внутренняя ошибка сервера"
+    return _stream_message(stream_format_name, 'error', {"error": message})
+
+
+_funds_bodies = {}
+
+
+def _split_param(value) -> tuple:
+    """'a, b,a' -> ('a', 'b'): нормализованный ключ для кэша готовых ответов."""
+    return tuple(sorted({item.strip() for item in (value or '').split(',') if item.strip()}))
+
+
+def _funds_body(catalog, fields: tuple, risk_levels: tuple) -> StaticAsset:
+    """
+    Сериализованный и сжатый список фондов; строится один раз на версию каталога
+    и набор параметров. Бросает ValueError при неизвестных полях.
+    """
+    key = (catalog.version, fields, risk_levels)
+    body = _funds_bodies.get(key)
+    if body is not None:
+        return body
+
+    unknown_fields = set(fields) - set().union(*catalog.funds)
+    if unknown_fields:
+        raise ValueError(f"Неизвестные поля фонда: {', '.join(sorted(unknown_fields))}")
+
+    if fields or risk_levels:
+        # В урезанном списке позиция фонда уже не совпадает с id из компактных ответов,
+        # поэтому id передается явно
+        funds = [
+            {'id': fund_id, **({field: fund[field] for field in fields if field in fund} if fields else fund)}
+            for fund_id, fund in enumerate(catalog.funds)
+            if not risk_levels or fund.get('risk_level') in risk_levels
+        ]
+    else:
+        funds = [dict(fund) for fund in catalog.funds]
+
+    if len(_funds_bodies) >= FUNDS_BODY_CACHE_SIZE:
+        _funds_bodies.clear()
+    body = _funds_bodies[key] = StaticAsset(codec.dumps(funds), 'application/json')
+    return body
+
+
+def funds_response(repository: CombinedRepository, query_args, if_none_match: str = None,
+                   accept_encoding: str = None) -> tuple:
+    """
+    (статус, [(заголовок, значение)], тело) для GET /api/funds.
+    Параметры: ?fields=name,risk_level — только эти поля (плюс id фонда);
+    ?risk_level=low,medium — только фонды этих уровней риска;
+    ?version=<X-Catalog-Version> — ответ этой версии кэшируется клиентом навсегда.
+    """
+    catalog = repository.get_catalog()
+    try:
+        body = _funds_body(catalog, _split_param(query_args.get('fields')), _split_param(query_args.get('risk_level')))
+    except ValueError as e:
+        return 400, [('Content-Type', 'application/json')], codec.dumps({"error": str(e)})
+
+    cache_control = IMMUTABLE_CACHE_CONTROL if query_args.get('version') == catalog.version else FUNDS_CACHE_CONTROL
+    status, headers, payload = body.respond(cache_control, if_none_match, accept_encoding)
+    return status, headers + [('X-Catalog-Version', catalog.version)], payload
+
+
+def record_request(endpoint: str, status: int, elapsed_seconds: float):
+    """Счетчики и гистограмма задержек одного запроса к /api/*."""
+    METRICS.inc('portfolio_http_requests_total', endpoint=endpoint, status=status)
+    if status >= 500:
+        METRICS.inc('portfolio_http_errors_total', endpoint=endpoint)
+    METRICS.observe('portfolio_http_request_duration_seconds', elapsed_seconds, endpoint=endpoint)
+
+
+def render_metrics(calculator: PortfolioCalculator, notifier: BotNotifier = None,
+                   executor: CalculationExecutor = None) -> str:
+    """
+    Тело ответа /api/metrics: метрики процесса, состояние кэша прогнозов,
+    очереди уведомлений и число принятых расчетов.
+    """
+    gauges, counters = {}, {}
+    if calculator.cache is not None:
+        for name, value in calculator.cache.stats().items():
+            # Попадания, промахи и вытеснения только растут — это счетчики; размер — gauge
+            if name in CACHE_COUNTER_STATS:
+                counters[f"portfolio_forecast_cache_{name}_total"] = value
+            else:
+                gauges[f"portfolio_forecast_cache_{name}"] = value
+    if executor is not None:
+        gauges['portfolio_calculations_in_flight'] = executor.in_flight()
+    if notifier is not None:
+        gauges['portfolio_notify_queue_depth'] = notifier.queue_depth()
+    return METRICS.render(gauges, counters)
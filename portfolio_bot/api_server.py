@@ -1,19 +1,31 @@
 # portfolio_bot/api_server.py
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request
 from flask_cors import CORS
 import os
-import requests  # Импортируем requests для отправки HTTP-запросов
+import time
 
 # Используем правильные импорты
-from portfolio_bot.database.repository import CombinedRepository
-from portfolio_bot.domain.calculator import PortfolioCalculator
+from portfolio_bot import codec
+from portfolio_bot.api_common import (
+    STATIC_FOLDER_PATH, build_backend, build_notifier, check_result_format, enqueue_notification,
+    format_result as format_calculation, funds_response, record_request, render_metrics,
+    stream_error, stream_event, stream_format, stream_headers
+)
+from portfolio_bot.codec import RequestValidationError
+from portfolio_bot.domain.executor import CalculationRejected, CalculationTimeout
+from portfolio_bot.domain.metrics import debug_log, stage
+from portfolio_bot.static_assets import StaticAssetCache
 
 # --- Инициализация бэкенд-логики ---
-repository = CombinedRepository()
-calculator = PortfolioCalculator(repository)
+# Где выполняются расчеты: inline | thread | process (см. CalculationExecutor)
+repository, calculator, executor = build_backend(default_backend='inline')
+# Уведомления боту доставляются в фоне (см. notifier.py)
+notifier = build_notifier()
 
 # Правильный расчет пути к папке с фронтендом
-static_folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'portfolio_mini_app'))
+static_folder_path = STATIC_FOLDER_PATH
+# Фронтенд целиком в памяти, со сжатием и ETag (см. static_assets.py)
+static_assets = StaticAssetCache(static_folder_path)
 
 print("---")
 print(f"✅ Сервер запущен. Рабочая директория: {os.getcwd()}")
@@ -26,23 +38,46 @@ app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Счетчики и гистограмма задержек для запросов к /api/* (статика не учитывается)."""
+    if request.path.startswith('/api/') and 'request_started' in g:
+        record_request(request.endpoint or 'unknown', response.status_code, time.perf_counter() - g.request_started)
+    return response
+
+
 @app.route('/', defaults={'path': 'index.html'})
 @app.route('/<path:path>')
 def serve_static(path):
     """
-    Отдает запрошенный файл из папки с фронтендом.
+    Отдает запрошенный файл из папки с фронтендом (из памяти, см. StaticAssetCache).
     """
-    if not os.path.isdir(static_folder_path):
-        return "Ошибка: Директория со статическими файлами не найдена.", 500
+    status, headers, body = static_assets.respond(
+        path,
+        if_none_match=request.headers.get('If-None-Match'),
+        accept_encoding=request.headers.get('Accept-Encoding')
+    )
+    return Response(body, status=status, headers=headers)
+
+
+def json_response(body, status: int = 200, headers: dict = None) -> Response:
+    """JSON-ответ через codec: orjson, если установлен; ряды прогноза — без .tolist()."""
+    return Response(codec.dumps(body), status=status, headers=headers, mimetype='application/json')
+
 
-    file_path = os.path.join(static_folder_path, path)
-    if not os.path.exists(file_path):
-         return f"Файл не найден: {path}", 404
+def request_json():
+    """Тело запроса как JSON (RequestValidationError, если это не JSON)."""
+    return codec.decode_request_body(request.get_data())
 
-    if path.endswith('.js'):
-        return send_from_directory(static_folder_path, path, mimetype='application/javascript')
 
-    return send_from_directory(static_folder_path, path)
+def format_result(result: dict) -> dict:
+    """Полный или компактный ответ в зависимости от параметров запроса (см. api_common.format_result)."""
+    return format_calculation(result, request.args, repository)
 
 
 @app.route('/api/calculate', methods=['POST'])
@@ -51,60 +86,133 @@ def calculate_portfolio_endpoint():
     Точка входа (endpoint) для расчетов.
     """
     try:
-        data = request.json
-        print(f"Получен API-запрос на /api/calculate: {data}")
-
-        result = calculator.calculate(
-            risk_profile=data.get('riskProfile'),
-            amount=int(data.get('amount')),
-            term_months=data.get('term_months'),
-            selected_funds=data.get('selected_funds'),
-            dreamAmount=data.get('dreamAmount'),
-            passiveIncome=data.get('passiveIncome'),
-            monthly_contribution=int(data.get('monthlyContribution', 0))
-        )
-        return jsonify(result)
-
+        data = request_json()
+        debug_log(f"Получен API-запрос на /api/calculate: {data}")
+
+        check_result_format(request.args)
+        result = executor.calculate(**codec.parse_calculate_request(data).as_kwargs())
+        with stage('serialization'):
+            return json_response(format_result(result))
+
+    except RequestValidationError as e:
+        return json_response({"error": str(e)}, 400)
+    except CalculationRejected as e:
+        return json_response({"error": "Сервер перегружен, попробуйте позже"}, 429, {'Retry-After': str(e.retry_after)})
+    except CalculationTimeout:
+        return json_response({"error": "Расчет занял слишком много времени"}, 504)
     except Exception as e:
         print(f"Произошла ошибка в /api/calculate: {e}")
-        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+        return json_response({"error": "Внутренняя ошибка сервера"}, 500)
+
+
+@app.route('/api/calculate/batch', methods=['POST'])
+def calculate_batch_endpoint():
+    """
+    Пакетный расчет: {"scenarios": [<запрос как для /api/calculate>, ...]}.
+    Сценарии с одинаковым риск-профилем и сроком считаются на общих случайных шоках.
+    """
+    try:
+        check_result_format(request.args)
+        scenarios = [scenario.as_kwargs() for scenario in codec.parse_batch_request(request_json())]
+        debug_log(f"Получен API-запрос на /api/calculate/batch: {len(scenarios)} сценари(ев)")
+
+        results = executor.calculate_batch(scenarios)
+        with stage('serialization'):
+            return json_response({"results": [format_result(result) for result in results]})
+
+    except RequestValidationError as e:
+        return json_response({"error": str(e)}, 400)
+    except CalculationRejected as e:
+        return json_response({"error": "Сервер перегружен, попробуйте позже"}, 429, {'Retry-After': str(e.retry_after)})
+    except CalculationTimeout:
+        return json_response({"error": "Расчет занял слишком много времени"}, 504)
+    except Exception as e:
+        print(f"Произошла ошибка в /api/calculate/batch: {e}")
+        return json_response({"error": "Внутренняя ошибка сервера"}, 500)
+
+@app.route('/api/calculate/stream', methods=['POST'])
+def calculate_stream_endpoint():
+    """
+    Потоковый расчет: тот же запрос, что и /api/calculate, но ответ приходит по шагам —
+    грубая оценка через несколько миллисекунд, затем уточнения и полный результат
+    (NDJSON; SSE, если Accept: text/event-stream). Когда клиент закрывает соединение,
+    сервер закрывает генератор ответа и оставшиеся шаги не считаются.
+    """
+    try:
+        check_result_format(request.args)
+        calculation = codec.parse_calculate_request(request_json())
+        debug_log(f"Получен API-запрос на /api/calculate/stream: {calculation}")
+        steps = executor.calculate_progressive(**calculation.as_kwargs())
+        # Первый шаг — до заголовков: отказ очереди или ошибка остаются обычным ответом
+        first_step = next(steps)
+
+    except RequestValidationError as e:
+        return json_response({"error": str(e)}, 400)
+    except CalculationRejected as e:
+        return json_response({"error": "Сервер перегружен, попробуйте позже"}, 429, {'Retry-After': str(e.retry_after)})
+    except CalculationTimeout:
+        return json_response({"error": "Расчет занял слишком много времени"}, 504)
+    except Exception as e:
+        print(f"Произошла ошибка в /api/calculate/stream: {e}")
+        return json_response({"error": "Внутренняя ошибка сервера"}, 500)
+
+    format_name = stream_format(request.headers.get('Accept'))
+    query_args = request.args.copy()
+
+    def generate():
+        try:
+            yield stream_event(format_name, first_step, query_args, repository)
+            for step in steps:
+                yield stream_event(format_name, step, query_args, repository)
+        except Exception as e:
+            yield stream_error(format_name, e, '/api/calculate/stream')
+        finally:
+            steps.close()
+
+    return Response(generate(), headers=stream_headers(format_name))
 
 @app.route('/api/funds', methods=['GET'])
 def get_all_funds_endpoint():
     """
-    Endpoint для получения списка всех фондов.
+    Endpoint для получения списка всех фондов (готовый сжатый ответ с ETag,
+    параметры fields / risk_level / version — см. api_common.funds_response).
     """
     try:
-        all_funds = repository.get_all_funds()
-        return jsonify(all_funds)
+        status, headers, body = funds_response(
+            repository, request.args,
+            if_none_match=request.headers.get('If-None-Match'),
+            accept_encoding=request.headers.get('Accept-Encoding')
+        )
+        return Response(body, status=status, headers=headers)
     except Exception as e:
         print(f"Произошла ошибка в /api/funds: {e}")
-        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+        return json_response({"error": "Внутренняя ошибка сервера"}, 500)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Метрики в текстовом формате Prometheus: запросы, ошибки, задержки,
+    длительности этапов расчета и состояние кэша прогнозов.
+    """
+    return Response(render_metrics(calculator, notifier, executor), mimetype='text/plain; version=0.0.4')
 
 # НОВЫЙ МЕТОД ДЛЯ ФОНОВОЙ ОТПРАВКИ СООБЩЕНИЯ
 @app.route('/api/notify', methods=['POST'])
 def notify_user_endpoint():
     """
-    Принимает данные от фронтенда и проксирует их боту для отправки сообщения.
+    Принимает данные от фронтенда и ставит их в очередь на отправку боту.
+    Ответ 202 возвращается сразу; доставку боту выполняют фоновые потоки notifier.
     """
     try:
-        data = request.json
-        # Мы просто пересылаем полученные данные на внутренний эндпоинт бота
-        # Предполагаем, что бот (main.py) запущен на порту 8080
-        # В реальном проде это будет адрес сервиса бота
-        bot_url = "http://127.0.0.1:8080/send_portfolio"
-        response = requests.post(bot_url, json=data)
-        
-        if response.status_code == 200:
-            print(f"✅ Запрос на уведомление успешно перенаправлен боту.")
-            return jsonify({"status": "ok"})
-        else:
-            print(f"⚠️ Ошибка при перенаправлении запроса боту: {response.text}")
-            return jsonify({"error": "Не удалось связаться с сервисом бота"}), 502
+        body, status = enqueue_notification(notifier, request_json())
+        return json_response(body, status)
+
+    except RequestValidationError as e:
+        return json_response({"error": str(e)}, 400)
 
     except Exception as e:
         print(f"Произошла ошибка в /api/notify: {e}")
-        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+        return json_response({"error": "Внутренняя ошибка сервера"}, 500)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,300 @@
+# portfolio_bot/asgi_server.py
+# ASGI-версия API-сервера: те же маршруты и JSON-контракты, что у api_server.py (Flask),
+# но без потока на запрос. Один процесс держит тысячи соединений мини-приложения:
+#   - расчеты уходят в CalculationExecutor (по умолчанию пул потоков, CALCULATION_BACKEND=process —
+#     пул процессов) и ожидаются через asyncio, не занимая цикл событий;
+#   - /api/calculate/stream отдает расчет по шагам и прекращает его, если клиент отключился;
+#   - уведомление боту (/api/notify) ставится в очередь и доставляется в фоне (notifier.py);
+#   - статика отдается из памяти (см. static_assets.py).
+#
+# Запуск (нужен uvicorn):
+#     uvicorn portfolio_bot.asgi_server:app --port 5001
+#     python -m portfolio_bot.asgi_server
+import asyncio
+import os
+import time
+from urllib.parse import parse_qsl
+
+from portfolio_bot import codec
+from portfolio_bot.api_common import (
+    STATIC_FOLDER_PATH, build_backend, build_notifier, enqueue_notification, format_result,
+    check_result_format, funds_response, record_request, render_metrics, stream_error, stream_event, stream_format, stream_headers
+)
+from portfolio_bot.codec import RequestValidationError
+from portfolio_bot.domain.executor import CalculationRejected, CalculationTimeout
+from portfolio_bot.domain.metrics import debug_log, stage
+from portfolio_bot.static_assets import StaticAssetCache
+
+# Максимальный размер тела запроса: запросы мини-приложения — единицы килобайт
+MAX_BODY_BYTES = 1024 * 1024
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+PREFLIGHT_HEADERS = CORS_HEADERS + [
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type'),
+]
+
+# --- Инициализация бэкенд-логики ---
+repository, calculator, executor = build_backend(default_backend='thread')
+static_assets = StaticAssetCache(STATIC_FOLDER_PATH)
+notifier = build_notifier()
+
+print("---")
+print(f"✅ ASGI-сервер готов. Бэкенд расчетов: {executor.backend}")
+print(f"✅ Путь к файлам фронтенда определен как: {STATIC_FOLDER_PATH}")
+print("---")
+
+
+class ApiRequest:
+    """Разобранный HTTP-запрос: параметры строки запроса, заголовки (имена в нижнем регистре) и тело."""
+
+    def __init__(self, query: dict, body: bytes, headers: dict = None):
+        self.query = query
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return codec.decode_request_body(self.body)
+
+
+def json_response(body, status: int = 200, headers: list = None) -> tuple:
+    return status, [(b'content-type', b'application/json')] + (headers or []), codec.dumps(body)
+
+
+def text_response(text: str, status: int, content_type: bytes = b'text/html; charset=utf-8') -> tuple:
+    return status, [(b'content-type', content_type)], text.encode()
+
+
+def _encode_headers(headers: list) -> list:
+    return [(name.lower().encode(), value.encode()) for name, value in headers]
+
+
+def calculation_error_response(error: Exception, endpoint_path: str) -> tuple:
+    """Те же коды и тексты ошибок, что и у Flask-версии."""
+    if isinstance(error, RequestValidationError):
+        return json_response({"error": str(error)}, 400)
+    if isinstance(error, CalculationRejected):
+        return json_response({"error": "Сервер перегружен, попробуйте позже"}, 429,
+                             headers=[(b'retry-after', str(error.retry_after).encode())])
+    if isinstance(error, CalculationTimeout):
+        return json_response({"error": "Расчет занял слишком много времени"}, 504)
+    print(f"Произошла ошибка в {endpoint_path}: {error}")
+    return json_response({"error": "Внутренняя ошибка сервера"}, 500)
+
+
+# --- Обработчики API ---
+
+async def calculate_portfolio_endpoint(request: ApiRequest) -> tuple:
+    try:
+        data = request.json()
+        debug_log(f"Получен API-запрос на /api/calculate: {data}")
+
+        check_result_format(request.query)
+        result = await executor.calculate_async(**codec.parse_calculate_request(data).as_kwargs())
+        with stage('serialization'):
+            return json_response(format_result(result, request.query, repository))
+    except Exception as e:
+        return calculation_error_response(e, '/api/calculate')
+
+
+async def calculate_batch_endpoint(request: ApiRequest) -> tuple:
+    try:
+        check_result_format(request.query)
+        scenarios = [scenario.as_kwargs() for scenario in codec.parse_batch_request(request.json())]
+        debug_log(f"Получен API-запрос на /api/calculate/batch: {len(scenarios)} сценари(ев)")
+
+        results = await executor.calculate_batch_async(scenarios)
+        with stage('serialization'):
+            return json_response({"results": [format_result(result, request.query, repository) for result in results]})
+    except Exception as e:
+        return calculation_error_response(e, '/api/calculate/batch')
+
+
+async def calculate_stream_endpoint(request: ApiRequest) -> tuple:
+    """Потоковый расчет (см. Flask-версию): тело ответа — асинхронный генератор событий."""
+    try:
+        check_result_format(request.query)
+        calculation = codec.parse_calculate_request(request.json())
+        debug_log(f"Получен API-запрос на /api/calculate/stream: {calculation}")
+        steps = executor.calculate_progressive_async(**calculation.as_kwargs())
+        first_step = await anext(steps)
+    except Exception as e:
+        return calculation_error_response(e, '/api/calculate/stream')
+
+    format_name = stream_format(request.headers.get('accept'))
+
+    async def generate():
+        try:
+            yield stream_event(format_name, first_step, request.query, repository)
+            async for step in steps:
+                yield stream_event(format_name, step, request.query, repository)
+        except Exception as e:
+            yield stream_error(format_name, e, '/api/calculate/stream')
+        finally:
+            await steps.aclose()
+
+    return 200, _encode_headers(stream_headers(format_name)), generate()
+
+
+async def get_all_funds_endpoint(request: ApiRequest) -> tuple:
+    try:
+        status, headers, body = funds_response(
+            repository, request.query,
+            if_none_match=request.headers.get('if-none-match'),
+            accept_encoding=request.headers.get('accept-encoding')
+        )
+        return status, _encode_headers(headers), body
+    except Exception as e:
+        print(f"Произошла ошибка в /api/funds: {e}")
+        return json_response({"error": "Внутренняя ошибка сервера"}, 500)
+
+
+async def metrics_endpoint(request: ApiRequest) -> tuple:
+    return text_response(render_metrics(calculator, notifier, executor), 200, b'text/plain; version=0.0.4; charset=utf-8')
+
+
+async def notify_user_endpoint(request: ApiRequest) -> tuple:
+    """Ставит уведомление в очередь (см. notifier.py) и сразу отвечает 202."""
+    try:
+        body, status = enqueue_notification(notifier, request.json())
+        return json_response(body, status)
+    except RequestValidationError as e:
+        return json_response({"error": str(e)}, 400)
+    except Exception as e:
+        print(f"Произошла ошибка в /api/notify: {e}")
+        return json_response({"error": "Внутренняя ошибка сервера"}, 500)
+
+
+# (метод, путь) -> (имя эндпоинта для метрик, как во Flask-версии; обработчик)
+ROUTES = {
+    ('POST', '/api/calculate'): ('calculate_portfolio_endpoint', calculate_portfolio_endpoint),
+    ('POST', '/api/calculate/batch'): ('calculate_batch_endpoint', calculate_batch_endpoint),
+    ('POST', '/api/calculate/stream'): ('calculate_stream_endpoint', calculate_stream_endpoint),
+    ('GET', '/api/funds'): ('get_all_funds_endpoint', get_all_funds_endpoint),
+    ('GET', '/api/metrics'): ('metrics_endpoint', metrics_endpoint),
+    ('POST', '/api/notify'): ('notify_user_endpoint', notify_user_endpoint),
+}
+
+
+# --- Статика ---
+
+def serve_static(scope, path: str) -> tuple:
+    """Отдает файл фронтенда из памяти: ответ 304 по ETag, сжатый вариант по Accept-Encoding."""
+    request_headers = dict(scope.get('headers', ()))
+    if_none_match = request_headers.get(b'if-none-match')
+    accept_encoding = request_headers.get(b'accept-encoding')
+    status, headers, body = static_assets.respond(
+        path,
+        if_none_match=if_none_match.decode('latin-1') if if_none_match else None,
+        accept_encoding=accept_encoding.decode('latin-1') if accept_encoding else None
+    )
+    return status, _encode_headers(headers), body
+
+
+# --- ASGI-приложение ---
+
+async def _read_body(receive) -> bytes:
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise ValueError("Тело запроса слишком большое")
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send_stream(receive, send, status: int, headers: list, chunks):
+    """
+    Потоковый ответ (без content-length). Как только клиент отключился, генератор
+    закрывается: следующие шаги расчета не начинаются.
+    """
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        async for chunk in chunks:
+            if disconnected.done():
+                return
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        await chunks.aclose()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.get_running_loop().run_in_executor(None, notifier.close)
+            executor.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _handle_api(scope, receive, method: str, path: str) -> tuple:
+    if method == 'OPTIONS':
+        return 204, list(PREFLIGHT_HEADERS), b''
+
+    route = ROUTES.get((method, path))
+    if route is None:
+        if any(route_path == path for _, route_path in ROUTES):
+            return json_response({"error": "Method not allowed"}, 405)
+        return json_response({"error": "Not found"}, 404)
+
+    endpoint, handler = route
+    started = time.perf_counter()
+    try:
+        body = await _read_body(receive)
+    except ValueError as e:
+        status, headers, payload = json_response({"error": str(e)}, 413)
+    else:
+        if body is None:
+            return None
+        query = dict(parse_qsl(scope.get('query_string', b'').decode()))
+        request_headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope.get('headers', ())}
+        status, headers, payload = await handler(ApiRequest(query, body, request_headers))
+    record_request(endpoint, status, time.perf_counter() - started)
+    return status, headers + CORS_HEADERS, payload
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method, path = scope['method'], scope['path']
+    if path.startswith('/api/'):
+        response = await _handle_api(scope, receive, method, path)
+        if response is None:  # клиент отключился, не дождавшись ответа
+            return
+    elif method in ('GET', 'HEAD'):
+        response = serve_static(scope, path)
+    else:
+        response = text_response("Method Not Allowed", 405)
+
+    status, headers, payload = response
+    if not isinstance(payload, bytes):
+        await _send_stream(receive, send, status, headers, payload)
+        return
+    headers = headers + [(b'content-length', str(len(payload)).encode())]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': payload if method != 'HEAD' else b''})
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host=os.environ.get('API_HOST', '127.0.0.1'), port=int(os.environ.get('API_PORT', 5001)))
@@ -0,0 +1,240 @@
+# portfolio_bot/codec.py
+# JSON API и бота: кодирование ответов, разбор и проверка запросов.
+#
+# Кодирование: если установлен orjson, ответ сериализуется им, включая массивы NumPy
+# (ряды прогноза калькулятор возвращает массивами, без .tolist()); иначе — стандартным
+# json, который переводит массивы в списки только в момент записи. Результат — UTF-8
+# байты без пробелов, кириллица не экранируется.
+#
+# Запросы: схема /api/calculate (CALCULATE_FIELDS) один раз компилируется в список
+# проверок; parse_calculate_request за один проход проверяет и приводит поля
+# к типам и возвращает CalculateRequest. Ошибка — RequestValidationError (ответ 400).
+import json
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # без orjson работает стандартный json
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+# Ограничения запроса /api/calculate
+MAX_AMOUNT = 10 ** 12
+MAX_TERM_MONTHS = 600
+MAX_SELECTED_FUNDS = 100
+MAX_EXTRA_PERCENTILES = 8
+# Сколько сценариев можно прислать в /api/calculate/batch
+MAX_BATCH_SCENARIOS = 32
+FORECAST_MODES = ('matrix', 'streaming', 'basis')
+FORECAST_ENGINES = ('mc', 'analytic', 'auto')
+
+
+class RequestValidationError(ValueError):
+    """Запрос не прошел проверку по схеме; текст ошибки отдается клиенту."""
+
+
+def _default(obj):
+    """Типы, которые JSON-бэкенд не сериализует сам: массивы и скаляры NumPy."""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f"Тип {type(obj).__name__} не сериализуется в JSON")
+
+
+if orjson is not None:
+    # Непрерывные массивы float64/int64 orjson пишет напрямую, остальные уходят в _default
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj) -> bytes:
+        """Объект (dict/list, в т.ч. с массивами NumPy) -> JSON в UTF-8 байтах."""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def loads(data):
+        """JSON (bytes или str) -> объект; ValueError, если JSON некорректен."""
+        return orjson.loads(data)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+    def dumps(obj) -> bytes:
+        """Объект (dict/list, в т.ч. с массивами NumPy) -> JSON в UTF-8 байтах."""
+        return _encoder.encode(obj).encode('utf-8')
+
+    def loads(data):
+        """JSON (bytes или str) -> объект; ValueError, если JSON некорректен."""
+        return json.loads(data)
+
+
+def decode_request_body(body):
+    """Тело HTTP-запроса -> объект; RequestValidationError, если это не JSON."""
+    try:
+        return loads(body)
+    except ValueError:
+        raise RequestValidationError("Некорректный JSON") from None
+
+
+# --- Схема запроса ---
+
+_MISSING = object()
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _integer(min_value: int = None, max_value: int = None):
+    def convert(value):
+        if isinstance(value, str):
+            try:
+                value = int(value.strip())
+            except ValueError:
+                raise RequestValidationError("ожидается целое число") from None
+        elif isinstance(value, float) and math.isfinite(value):
+            # Как и int(...) раньше: дробная часть отбрасывается
+            value = int(value)
+        elif not isinstance(value, int) or isinstance(value, bool):
+            raise RequestValidationError("ожидается целое число")
+        if (min_value is not None and value < min_value) or (max_value is not None and value > max_value):
+            raise RequestValidationError(f"ожидается число от {min_value} до {max_value}")
+        return value
+    return convert
+
+
+def _number(min_value: float = None):
+    def convert(value):
+        if isinstance(value, str):
+            try:
+                value = float(value.strip())
+            except ValueError:
+                raise RequestValidationError("ожидается число") from None
+            if not math.isfinite(value):
+                raise RequestValidationError("ожидается конечное число")
+            value = int(value) if value.is_integer() else value
+        elif not _is_number(value) or not math.isfinite(value):
+            raise RequestValidationError("ожидается конечное число" if _is_number(value) else "ожидается число")
+        if min_value is not None and value < min_value:
+            raise RequestValidationError(f"ожидается число не меньше {min_value}")
+        return value
+    return convert
+
+
+def _string(max_length: int = 100):
+    def convert(value):
+        if not isinstance(value, str) or not value:
+            raise RequestValidationError("ожидается непустая строка")
+        if len(value) > max_length:
+            raise RequestValidationError(f"строка длиннее {max_length} символов")
+        return value
+    return convert
+
+
+def _choice(options: tuple):
+    allowed = frozenset(options)
+
+    def convert(value):
+        if value not in allowed:
+            raise RequestValidationError(f"ожидается одно из: {', '.join(options)}")
+        return value
+    return convert
+
+
+def _list_of(item, max_items: int):
+    def convert(value):
+        if not isinstance(value, list):
+            raise RequestValidationError("ожидается список")
+        if len(value) > max_items:
+            raise RequestValidationError(f"больше {max_items} элементов")
+        return tuple(item(element) for element in value)
+    return convert
+
+
+def _percentile(value):
+    if not _is_number(value) or not 0 < value < 100:
+        raise RequestValidationError("перцентиль — число от 0 до 100 (не включая)")
+    return float(value)
+
+
+@dataclass(frozen=True, slots=True)
+class CalculateRequest:
+    """Проверенный запрос /api/calculate; as_kwargs() — аргументы calculator.calculate()."""
+    risk_profile: str
+    amount: int
+    term_months: int = None
+    selected_funds: tuple = None
+    dreamAmount: float = None
+    passiveIncome: float = None
+    monthly_contribution: int = 0
+    forecast_mode: str = None
+    forecast_engine: str = None
+    extra_percentiles: tuple = None
+
+    def as_kwargs(self) -> dict:
+        kwargs = {field: getattr(self, field) for field in self.__slots__}
+        for field in ('selected_funds', 'extra_percentiles'):
+            if kwargs[field] is not None:
+                kwargs[field] = list(kwargs[field])
+        return kwargs
+
+
+# (поле JSON, атрибут CalculateRequest, преобразование, значение по умолчанию).
+# Без значения по умолчанию (_MISSING) поле обязательно; null и "" считаются отсутствием поля.
+CALCULATE_FIELDS = (
+    ('riskProfile', 'risk_profile', _string(), _MISSING),
+    ('amount', 'amount', _integer(0, MAX_AMOUNT), _MISSING),
+    ('term_months', 'term_months', _integer(1, MAX_TERM_MONTHS), None),
+    ('selected_funds', 'selected_funds', _list_of(_string(200), MAX_SELECTED_FUNDS), None),
+    ('dreamAmount', 'dreamAmount', _number(0), None),
+    ('passiveIncome', 'passiveIncome', _number(0), None),
+    ('monthlyContribution', 'monthly_contribution', _integer(0, MAX_AMOUNT), 0),
+    ('forecastMode', 'forecast_mode', _choice(FORECAST_MODES), None),
+    ('forecastEngine', 'forecast_engine', _choice(FORECAST_ENGINES), None),
+    ('extraPercentiles', 'extra_percentiles', _list_of(_percentile, MAX_EXTRA_PERCENTILES), None),
+)
+
+
+def compile_schema(fields: tuple, factory):
+    """
+    Схема -> функция разбора: dict JSON-запроса -> factory(**поля).
+    Лишние поля запроса игнорируются (мини-приложение присылает investmentData целиком).
+    """
+    checks = tuple(fields)
+
+    def parse(data):
+        if not isinstance(data, dict):
+            raise RequestValidationError("Тело запроса должно быть JSON-объектом")
+        values = {}
+        for name, attribute, convert, default in checks:
+            value = data.get(name)
+            if value is None or value == '':
+                if default is _MISSING:
+                    raise RequestValidationError(f"Не задано поле {name}")
+                values[attribute] = default
+                continue
+            try:
+                values[attribute] = convert(value)
+            except RequestValidationError as e:
+                raise RequestValidationError(f"Поле {name}: {e}") from None
+        return factory(**values)
+
+    return parse
+
+
+parse_calculate_request = compile_schema(CALCULATE_FIELDS, CalculateRequest)
+parse_calculate_request.__doc__ = "JSON-запрос мини-приложения -> CalculateRequest (RequestValidationError при ошибке)."
+
+
+def parse_batch_request(data) -> list:
+    """{"scenarios": [...]} -> список CalculateRequest."""
+    scenarios = data.get('scenarios') if isinstance(data, dict) else None
+    if not isinstance(scenarios, list) or not scenarios:
+        raise RequestValidationError("Список сценариев пуст")
+    if len(scenarios) > MAX_BATCH_SCENARIOS:
+        raise RequestValidationError(f"Не больше {MAX_BATCH_SCENARIOS} сценариев в одном запросе")
+    requests = []
+    for index, scenario in enumerate(scenarios):
+        try:
+            requests.append(parse_calculate_request(scenario))
+        except RequestValidationError as e:
+            raise RequestValidationError(f"Сценарий {index}: {e}") from None
+    return requests
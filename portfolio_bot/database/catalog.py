@@ -0,0 +1,101 @@
+# portfolio_bot/database/catalog.py
+from types import MappingProxyType
+
+
+def portfolio_metrics(portfolio: list, composition: dict) -> tuple:
+    """
+    Ожидаемая доходность и волатильность портфеля (в %): доли composition
+    по уровням риска, взвешенные по фонду, выбранному на каждый уровень.
+    """
+    total_return = 0
+    total_volatility = 0
+    risk_to_fund_map = {fund.get('risk_level'): fund for fund in portfolio}
+
+    for risk_level, percentage in composition.items():
+        fund_for_level = risk_to_fund_map.get(risk_level)
+        if fund_for_level:
+            share_fraction = percentage / 100.0
+            total_return += fund_for_level['annual_return_percent'] * share_fraction
+            total_volatility += fund_for_level['volatility_percent'] * share_fraction
+
+    return total_return, total_volatility
+
+
+def freeze_template(template: dict) -> MappingProxyType:
+    """Копия шаблона стратегии только для чтения (вместе с вложенным составом)."""
+    return MappingProxyType({**template, 'composition': MappingProxyType(dict(template['composition']))})
+
+
+def derive_template(template, **changes) -> dict:
+    """
+    Изменяемая копия шаблона для одного расчета: общий шаблон из каталога
+    не меняется, поэтому расчеты из разных потоков не мешают друг другу.
+    """
+    derived = {**template, 'composition': dict(template['composition'])}
+    derived.update(changes)
+    return derived
+
+
+class FundCatalog:
+    """
+    Неизменяемый снимок каталога фондов с индексами для сборки портфеля.
+    Строится один раз на версию каталога (см. CombinedRepository.get_catalog):
+      - by_name: название -> фонд; fund_ids: название -> id фонда;
+      - by_risk: уровень риска -> фонды, отсортированные по доходности (по убыванию);
+      - templates: риск-профиль -> шаблон стратегии (только для чтения, см. derive_template);
+      - template_portfolios / template_metrics: лучшие фонды и доходность/волатильность
+        для каждого шаблона стратегии.
+    Сборка портфеля по снимку стоит O(k) от размера портфеля, а не от размера каталога.
+    """
+
+    def __init__(self, version: str, funds: list, strategy_templates: dict):
+        self.version = version
+        self.funds = tuple(MappingProxyType(dict(fund)) for fund in funds)
+        self.by_name = MappingProxyType({fund['name']: fund for fund in self.funds})
+        # Идентификатор фонда — его позиция в списке /api/funds этой версии каталога
+        self.fund_ids = MappingProxyType({fund['name']: fund_id for fund_id, fund in enumerate(self.funds)})
+
+        by_risk = {}
+        for fund in self.funds:
+            by_risk.setdefault(fund.get('risk_level'), []).append(fund)
+        self.by_risk = MappingProxyType({
+            risk_level: tuple(sorted(level_funds, key=lambda f: f['annual_return_percent'], reverse=True))
+            for risk_level, level_funds in by_risk.items()
+        })
+
+        self.templates = MappingProxyType({
+            profile: freeze_template(template) for profile, template in strategy_templates.items()
+        })
+
+        self._best_funds = {}
+        self.template_portfolios = MappingProxyType({
+            profile: self.best_funds_for_levels(template['composition'])
+            for profile, template in self.templates.items()
+        })
+        self.template_metrics = MappingProxyType({
+            profile: portfolio_metrics(self.template_portfolios[profile], template['composition'])
+            for profile, template in self.templates.items()
+        })
+
+    def best_funds_for_levels(self, risk_levels) -> tuple:
+        """
+        Самый доходный фонд на каждый уровень риска (без повторов), в порядке уровней.
+        Результат зависит только от набора уровней, поэтому запоминается.
+        """
+        risk_levels = tuple(risk_levels)
+        portfolio = self._best_funds.get(risk_levels)
+        if portfolio is None:
+            used_funds = set()
+            picks = []
+            for risk_level in risk_levels:
+                best_fund = next((f for f in self.by_risk.get(risk_level, ()) if f['name'] not in used_funds), None)
+                if best_fund:
+                    picks.append(best_fund)
+                    used_funds.add(best_fund['name'])
+            portfolio = tuple(picks)
+            self._best_funds[risk_levels] = portfolio
+        return portfolio
+
+    def find_funds(self, fund_names: list) -> list:
+        """Фонды по названиям (неизвестные названия пропускаются)."""
+        return [self.by_name[name] for name in fund_names if name in self.by_name]
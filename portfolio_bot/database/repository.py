@@ -1,8 +1,11 @@
 # portfolio_bot/database/repository.py
 import sqlite3
 import os
+import json
+import hashlib
 # Используем относительный импорт, так как находимся в одном пакете
 from .funds_data import ALL_FUNDS, STRATEGY_TEMPLATES
+from .catalog import FundCatalog
 
 # Определяем путь к папке для данных внутри пакета portfolio_bot
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
@@ -18,6 +21,8 @@ class CombinedRepository:
     """
     def __init__(self):
         self._init_db()
+        self._catalog_version = None
+        self._catalog = None
 
     # --- Методы для работы с SQLite (пользователи) ---
 
@@ -65,12 +70,40 @@ class CombinedRepository:
 
     # --- Методы для работы со статическими данными ---
 
-    def get_all_funds(self) -> list:
-        """Возвращает список всех доступных фондов."""
-        print("[РЕПОЗИТОРИЙ] Запрошены все фонды.")
-        return ALL_FUNDS
+    def get_all_funds(self) -> tuple:
+        """Возвращает все доступные фонды (только для чтения, из снимка каталога)."""
+        return self.get_catalog().funds
 
-    def get_strategy_template(self, risk_profile: str) -> dict:
-        """Возвращает шаблон стратегии по названию риск-профиля."""
-        print(f"[РЕПОЗИТОРИЙ] Запрошен шаблон для '{risk_profile}'.")
-        return STRATEGY_TEMPLATES.get(risk_profile)
+    def get_strategy_template(self, risk_profile: str):
+        """
+        Возвращает шаблон стратегии по названию риск-профиля.
+        Шаблон доступен только для чтения: для изменений используйте catalog.derive_template.
+        """
+        return self.get_catalog().templates.get(risk_profile)
+
+    def get_strategy_profiles(self) -> list:
+        """Возвращает названия всех риск-профилей, для которых есть шаблоны."""
+        return list(self.get_catalog().templates)
+
+    def get_catalog_version(self) -> str:
+        """
+        Возвращает версию каталога (хэш фондов и шаблонов стратегий).
+        Используется как часть ключа кэша расчетов и сверяется с версией сетки прогнозов.
+        Каталог — статические данные funds_data, поэтому версия считается один раз
+        на процесс: новый каталог приходит с деплоем и перезапуском.
+        """
+        if self._catalog_version is None:
+            payload = json.dumps([ALL_FUNDS, STRATEGY_TEMPLATES], sort_keys=True, ensure_ascii=False)
+            self._catalog_version = hashlib.sha256(payload.encode()).hexdigest()[:16]
+        return self._catalog_version
+
+    def get_catalog(self) -> FundCatalog:
+        """
+        Возвращает неизменяемый индексированный снимок каталога (см. FundCatalog).
+        Снимок строится один раз и переиспользуется всеми расчетами.
+        """
+        if self._catalog is None:
+            version = self.get_catalog_version()
+            self._catalog = FundCatalog(version, ALL_FUNDS, STRATEGY_TEMPLATES)
+            print(f"[РЕПОЗИТОРИЙ] Собран снимок каталога {version}: {len(self._catalog.funds)} фондов.")
+        return self._catalog
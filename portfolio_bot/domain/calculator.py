@@ -1,56 +1,234 @@
 import numpy as np
+import hashlib
 import math
+from statistics import NormalDist
+
+from .forecast_cache import ForecastCache
+from ..database.catalog import derive_template, portfolio_metrics
+from .metrics import METRICS, debug_log, request_timings, stage, timed_stage
+
+try:
+    from scipy.stats import qmc
+    from scipy.special import ndtri
+except ImportError:  # scipy нужен только для квази-Монте-Карло ('sobol')
+    qmc = None
 
 PASSIVE_INCOME_RATE_PERCENT = 18.0
 NUM_SIMULATIONS = 2000
+# Число путей в промежуточных оценках потокового расчета (calculate_progressive);
+# степени двойки, чтобы подходили и для 'sobol'
+PROGRESSIVE_SIMULATIONS = (256, 1024)
+# --- Способ генерации шоков: 'pseudo' (обычные псевдослучайные), 'antithetic'
+# (пары Z и -Z), 'sobol' (скремблированная последовательность Соболя, нужен scipy;
+# число путей лучше брать степенью двойки).
+# Стандартные ошибки по числу путей: benchmarks/sampling_error.py ---
+SAMPLING_METHOD = 'antithetic'
+# --- Режим прогноза: 'matrix' держит всю матрицу путей, 'streaming' идет по горизонтам,
+# 'basis' переиспользует единичные пути A_t, B_t (капитал = сумма*A_t + пополнение*B_t) ---
+FORECAST_MODE = 'basis'
+# Сколько месяцев моделируется за один шаг в потоковом режиме (пиковая память ~ N * шаг)
+STREAMING_CHUNK_MONTHS = 12
+# Сколько наборов единичных путей (на пару "состав стратегии, срок") держать в памяти.
+# Набор — две матрицы float64 (срок+1) x число путей: 2 * 361 * 2000 * 8 байт ~ 11.5 МБ
+# на 360 мес., поэтому кэш ограничен еще и по байтам. Кэш один на процесс (общий для всех
+# калькуляторов, включая калькуляторы промежуточных оценок), так что всего под него уходит
+# до BASIS_CACHE_MAX_BYTES на каждый процесс: воркер API или процесс пула расчетов
+BASIS_CACHE_SIZE = 16
+BASIS_CACHE_MAX_BYTES = 48 * 1024 * 1024
+# Сколько таблиц перцентилей (уровни, отношение пополнения к сумме) хранить при наборе путей:
+# таблица (срок+1) x число уровней — единицы КБ
+BASIS_BANDS_CACHE_SIZE = 16
+# По сколько месяцев собирается сумма путей при расчете перцентилей: вместо матрицы
+# (срок+1) x число путей в памяти живет только блок строк
+BASIS_COMBINE_CHUNK_MONTHS = 32
+# --- Движок прогноза: 'mc' (Монте-Карло), 'analytic' (логнормальная аппроксимация), 'auto' ---
+FORECAST_ENGINE = 'mc'
+# В режиме 'auto' аналитика используется, пока дисперсия логарифма капитала (sigma^2 * лет)
+# не превышает порога: при 0.15 ошибка полос ~1%, см. benchmarks/analytic_accuracy.py
+ANALYTIC_AUTO_MAX_LOG_VARIANCE = 0.15
+# --- Подбор безубыточного состава: шаг грубой сетки и точность по доле облигаций (п.п.) ---
+NO_LOSS_GRID_STEP_PERCENT = 5.0
+NO_LOSS_PRECISION_PERCENT = 0.5
+NO_LOSS_MAX_BONDS_PERCENT = 95.0
 # --- NEW: Deposit rate based on the provided image ---
 DEPOSIT_ANNUAL_RATE_PERCENT = 15.3
 
+
+def _basis_nbytes(basis) -> int:
+    """Память набора единичных путей (для ограничения кэша по байтам)."""
+    return basis["amount"].nbytes + basis["contribution"].nbytes
+
+
+# Единичные пути для режима 'basis', общие для всех калькуляторов процесса
+_BASIS_CACHE = ForecastCache(max_size=BASIS_CACHE_SIZE, max_bytes=BASIS_CACHE_MAX_BYTES, sizeof=_basis_nbytes)
+
 class PortfolioCalculator:
-    def __init__(self, repository):
+    def __init__(self, repository, cache=None, grid=None, num_simulations: int = None, sampling_method: str = None):
         self.repository = repository
+        self.num_simulations = num_simulations or NUM_SIMULATIONS
+        self.sampling_method = sampling_method or SAMPLING_METHOD
+        if self.sampling_method not in ('pseudo', 'antithetic', 'sobol'):
+            raise ValueError(f"Неизвестный способ генерации шоков: {self.sampling_method}")
+        if self.sampling_method == 'sobol' and qmc is None:
+            print("⚠️ [КАЛЬКУЛЯТОР] scipy не установлен, вместо 'sobol' используются антитетические пары.")
+            self.sampling_method = 'antithetic'
+        # Необязательный ForecastCache: одинаковые запросы отдаются без повторной симуляции
+        self.cache = cache
+        # Необязательная предрасчитанная ForecastGrid: стандартные стратегии без симуляции
+        self.grid = grid
+        # Единичные пути для режима 'basis' (общий кэш процесса), ключ — (зерно, срок,
+        # доходность, волатильность, число путей, способ генерации шоков)
+        self._basis_cache = _BASIS_CACHE
+        # Калькуляторы с меньшим числом путей для промежуточных оценок: число путей -> калькулятор
+        self._preview_calculators = {}
 
     def calculate(self, risk_profile: str, amount: int, term: int = None,
                   selected_funds: list = None, dreamAmount: int = None, passiveIncome: int = None, term_months: int = None,
-                  monthly_contribution: int = 0) -> dict: # <-- НОВЫЙ ПАРАМЕТР
+                  monthly_contribution: int = 0, forecast_mode: str = None,
+                  extra_percentiles: list = None, random_shocks=None, forecast_engine: str = None) -> dict: # <-- НОВЫЙ ПАРАМЕТР
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.request_key(
+                risk_profile, amount, term=term, selected_funds=selected_funds, dreamAmount=dreamAmount,
+                passiveIncome=passiveIncome, term_months=term_months, monthly_contribution=monthly_contribution,
+                forecast_mode=forecast_mode, extra_percentiles=extra_percentiles, forecast_engine=forecast_engine
+            )
 
-        if term_months:
-            num_months = term_months
-            term = round(term_months / 12, 1)
-        else:
-            num_months = (term or 1) * 12
+        num_months, term = self._resolve_term(term, term_months)
+        forecast_mode = forecast_mode or FORECAST_MODE
+        forecast_engine = forecast_engine or FORECAST_ENGINE
+        if forecast_engine not in ('mc', 'analytic', 'auto'):
+            raise ValueError(f"Неизвестный движок прогноза: {forecast_engine}")
+        extra_percentiles = [float(q) for q in extra_percentiles or []]
 
-        print(f"\n--- 🚀 [КАЛЬКУЛЯТОР] Начат новый расчет... ---")
-        print(f"Входные данные: Риск='{risk_profile}', Сумма={amount}, Срок={num_months} мес., Пополнение={monthly_contribution}, Цель(сумма)={dreamAmount}, Цель(доход)={passiveIncome}")
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
 
+        with request_timings():
+            result = self._calculate(risk_profile, amount, num_months, term, selected_funds, dreamAmount, passiveIncome,
+                                     monthly_contribution, forecast_engine, forecast_mode, extra_percentiles, random_shocks)
+
+        if cache_key is not None and 'error' not in result:
+            self.cache.put(cache_key, result)
+        return result
+
+    def calculate_progressive(self, *args, **kwargs):
+        """
+        Генератор расчета "от грубого к точному": (событие, число путей, результат).
+        Сначала идут оценки 'estimate' по PROGRESSIVE_SIMULATIONS путей (первая — за
+        единицы миллисекунд), последним — полный результат 'result', тот же, что у calculate().
+        Следующий шаг считается, только когда его запросили: если потребитель перестал
+        перебирать генератор (клиент ушел), оставшиеся симуляции не выполняются.
+
+        Оценки не нужны, если полный результат уже в кэше или прогноз строится без
+        симуляции (сетка, аналитика): тогда сразу отдается 'result'.
+        """
+        for num_simulations in self.progressive_plan(*args, **kwargs):
+            estimate = self.calculate_estimate(num_simulations, *args, **kwargs)
+            if 'error' in estimate or estimate['forecast_engine'] != 'mc':
+                break
+            yield 'estimate', num_simulations, estimate
+        yield 'result', self.num_simulations, self.calculate(*args, **kwargs)
+
+    def progressive_plan(self, *args, **kwargs) -> tuple:
+        """Числа путей промежуточных оценок calculate_progressive() (пусто, если результат уже в кэше)."""
+        if self.cache is not None and self.request_key(*args, **kwargs) in self.cache:
+            return ()
+        return tuple(n for n in PROGRESSIVE_SIMULATIONS if n < self.num_simulations)
+
+    def calculate_estimate(self, num_simulations: int, *args, **kwargs) -> dict:
+        """Промежуточная оценка calculate() по num_simulations путей."""
+        return self._preview_calculator(num_simulations).calculate(*args, **kwargs)
+
+    def _preview_calculator(self, num_simulations: int) -> 'PortfolioCalculator':
+        calculator = self._preview_calculators.get(num_simulations)
+        if calculator is None:
+            # Без кэша результатов: оценки не должны вытеснять полные расчеты
+            calculator = PortfolioCalculator(self.repository, grid=self.grid, num_simulations=num_simulations,
+                                             sampling_method=self.sampling_method)
+            self._preview_calculators[num_simulations] = calculator
+        return calculator
+
+    def request_key(self, risk_profile: str, amount: int, term: int = None,
+                    selected_funds: list = None, dreamAmount: int = None, passiveIncome: int = None, term_months: int = None,
+                    monthly_contribution: int = 0, forecast_mode: str = None,
+                    extra_percentiles: list = None, random_shocks=None, forecast_engine: str = None) -> tuple:
+        """
+        Нормализованный ключ запроса calculate() вместе с версией каталога: у запросов
+        с одинаковым результатом ключ один и тот же. Используется кэшем результатов
+        и объединением одинаковых одновременных расчетов (см. CalculationExecutor).
+        """
+        num_months, term = self._resolve_term(term, term_months)
+        return (
+            self.repository.get_catalog_version(), risk_profile, amount, num_months, term,
+            tuple(selected_funds) if selected_funds else None, dreamAmount, passiveIncome,
+            monthly_contribution, forecast_engine or FORECAST_ENGINE, forecast_mode or FORECAST_MODE,
+            tuple(float(q) for q in extra_percentiles or []), self.num_simulations, self.sampling_method
+        )
+
+    def _calculate(self, risk_profile, amount, num_months, term, selected_funds, dreamAmount, passiveIncome,
+                   monthly_contribution, forecast_engine, forecast_mode, extra_percentiles, random_shocks):
+        debug_log(f"\n--- 🚀 [КАЛЬКУЛЯТОР] Начат новый расчет... ---")
+        debug_log(f"Входные данные: Риск='{risk_profile}', Сумма={amount}, Срок={num_months} мес., Пополнение={monthly_contribution}, Цель(сумма)={dreamAmount}, Цель(доход)={passiveIncome}")
+
+        with stage('template_lookup'):
+            catalog = self.repository.get_catalog()
+            strategy_template = self.repository.get_strategy_template(risk_profile)
+        is_standard_template = True
         if risk_profile == 'conservative' and num_months <= 12:
-            print("\n--- 🛡️ [КАЛЬКУЛЯТОР] Активирован режим защиты капитала для краткосрочного консервативного портфеля... ---")
-            strategy_template = self.repository.get_strategy_template('no-loss')
-            all_funds = self.repository.get_all_funds()
-            if not strategy_template:
-                strategy_template = self.repository.get_strategy_template('conservative')
-            
-            strategy_template['composition'] = self._find_no_loss_composition(
-                initial_composition=strategy_template['composition'].copy(),
-                all_funds=all_funds,
-                amount=amount,
-                num_months=num_months,
-                monthly_contribution=monthly_contribution
+            debug_log("\n--- 🛡️ [КАЛЬКУЛЯТОР] Активирован режим защиты капитала для краткосрочного консервативного портфеля... ---")
+            with stage('template_lookup'):
+                base_template = self.repository.get_strategy_template('no-loss') or strategy_template
+            is_standard_template = False
+
+            # Общий шаблон не меняется: состав подбирается в копии для этого расчета
+            strategy_template = derive_template(
+                base_template,
+                composition=self._find_no_loss_composition(
+                    initial_composition=dict(base_template['composition']),
+                    catalog=catalog,
+                    amount=amount,
+                    num_months=num_months,
+                    monthly_contribution=monthly_contribution,
+                    seed_key=(risk_profile, num_months)
+                ),
+                name="Консервативная (с защитой капитала)"
             )
-            strategy_template['name'] = "Консервативная (с защитой капитала)"
-            print(f"--- Итоговая безопасная композиция: {strategy_template['composition']} ---\n")
-        
-        else:
-            strategy_template = self.repository.get_strategy_template(risk_profile)
-            all_funds = self.repository.get_all_funds()
+            debug_log(f"--- Итоговая безопасная композиция: {strategy_template['composition']} ---\n")
 
         if not strategy_template:
             return {"error": f"Стратегия '{risk_profile}' не найдена."}
 
-        portfolio_composition = self._assemble_portfolio(strategy_template, all_funds, selected_funds)
-        total_return, total_volatility = self._calculate_portfolio_metrics(portfolio_composition, strategy_template)
-        
-        forecast = self._generate_forecast_monte_carlo(amount, num_months, total_return, total_volatility, monthly_contribution, risk_profile)
+        if is_standard_template and not selected_funds and risk_profile in catalog.template_metrics:
+            # Стандартная стратегия: фонды и метрики уже посчитаны в снимке каталога
+            portfolio_composition = list(catalog.template_portfolios[risk_profile])
+            total_return, total_volatility = catalog.template_metrics[risk_profile]
+        else:
+            with stage('assembly'):
+                portfolio_composition = self._assemble_portfolio(strategy_template, catalog, selected_funds)
+            with stage('metrics'):
+                total_return, total_volatility = self._calculate_portfolio_metrics(portfolio_composition, strategy_template)
+
+        forecast_engine = self._resolve_engine(forecast_engine, num_months, total_volatility)
+        with stage('forecast'):
+            forecast = None
+            if self.grid is not None and forecast_engine == 'mc' and not extra_percentiles and random_shocks is None:
+                # Стандартная стратегия на сетке: прогноз без симуляции
+                forecast = self.grid.lookup(risk_profile, amount, monthly_contribution, num_months, total_return, total_volatility)
+
+            if forecast is not None:
+                forecast_engine = 'grid'
+            elif forecast_engine == 'analytic':
+                forecast = self._generate_forecast_analytic(amount, num_months, total_return, total_volatility, monthly_contribution, risk_profile,
+                                                            extra_percentiles=extra_percentiles)
+            else:
+                forecast = self._generate_forecast_monte_carlo(amount, num_months, total_return, total_volatility, monthly_contribution, risk_profile,
+                                                               forecast_mode=forecast_mode, extra_percentiles=extra_percentiles,
+                                                               random_shocks=random_shocks, seed_key=(risk_profile, num_months))
+        METRICS.inc('portfolio_calculations_total', engine=forecast_engine)
         
         # --- NEW: Calculate deposit forecast ---
         deposit_forecast = self._generate_deposit_forecast(amount, num_months, monthly_contribution)
@@ -73,92 +251,147 @@ class PortfolioCalculator:
             "expected_annual_return": f"{total_return:.1f}",
             "composition": final_composition_details,
             "forecast": forecast,
+            "forecast_engine": forecast_engine,
             "deposit_forecast": deposit_forecast, # <-- NEW
             "goal_dream_amount": dreamAmount,
             "goal_target_capital": target_capital,
             "monthly_income_forecast": monthly_income_forecast,
             "passiveIncome": passiveIncome
         }
-        print("--- ✅ [КАЛЬКУЛЯТОР] Расчет завершен. ---\n")
+        debug_log("--- ✅ [КАЛЬКУЛЯТОР] Расчет завершен. ---\n")
         return result
 
-    def _find_no_loss_composition(self, initial_composition: dict, all_funds: list, amount: int, num_months: int, monthly_contribution: int = 0) -> dict:
-        current_composition = initial_composition
-        
-        for i in range(10): 
-            temp_strategy = {"composition": current_composition}
-            portfolio_funds = self._assemble_portfolio(temp_strategy, all_funds)
-            total_return, total_volatility = self._calculate_portfolio_metrics(portfolio_funds, temp_strategy)
-            
-            # --- ИЗМЕНЕНИЕ: Указываем риск-профиль "no-loss" для расчета перцентилей ---
-            forecast = self._generate_forecast_monte_carlo(amount, num_months, total_return, total_volatility, monthly_contribution, 'no-loss')
-            min_final_amount = forecast['min'][-1]
-            total_invested = amount + (monthly_contribution * num_months)
-
-            print(f"Итерация {i+1}: Доля облигаций {current_composition.get('bonds', 0):.1f}%. Мин. прогноз: {min_final_amount:,.0f} ₽ (Цель: >= {total_invested:,.0f} ₽)")
-
-            if min_final_amount >= total_invested:
-                print("--- ✅ Условие безубыточности достигнуто. ---")
-                return current_composition
-            
-            bonds_share = current_composition.get('bonds', 0)
-            if bonds_share >= 95:
-                print("--- ⚠️ Достигнут лимит облигаций (95%). Возвращаем самую безопасную из возможных композиций. ---")
-                return current_composition
-
-            increase_by = 5.0
-            risky_assets = {k: v for k, v in current_composition.items() if k != 'bonds'}
-            total_risky_share = sum(risky_assets.values())
-
-            if total_risky_share <= increase_by:
-                 final_composition = {'bonds': 100}
-                 for key in risky_assets: final_composition[key] = 0
-                 return final_composition
-
-            for key, value in risky_assets.items():
-                reduction = (value / total_risky_share) * increase_by
-                current_composition[key] -= reduction
-            
-            current_composition['bonds'] = bonds_share + increase_by
-            
-            total_sum = sum(current_composition.values())
-            for key in current_composition:
-                current_composition[key] = (current_composition[key] / total_sum) * 100
-
-        print("--- ⚠️ Не удалось достичь безубыточности за 10 итераций. Возвращается последняя рассчитанная композиция. ---")
-        return current_composition
-
-    def _assemble_portfolio(self, strategy_template, all_funds, selected_funds=None):
-        portfolio = []
+    def calculate_batch(self, scenarios: list) -> list:
+        """
+        Считает несколько сценариев за один проход. Сценарии с одинаковым риск-профилем
+        и сроком используют одну и ту же матрицу шоков (общие случайные числа), поэтому,
+        например, прогнозы "с пополнениями" и "без" сравнимы между собой без шума.
+        Каждый сценарий — словарь с аргументами calculate().
+
+        Шоки берутся из того же детерминированного генератора, что и в calculate(),
+        поэтому пакетный результат совпадает с одиночным расчетом тех же входных
+        данных (с точностью до округления).
+        """
+        shocks_by_key = {}
+        results = []
+        for scenario in scenarios:
+            if (scenario.get('forecast_mode') or FORECAST_MODE) == 'basis':
+                # Единичные пути и так общие для всех сценариев с тем же профилем и сроком
+                results.append(self.calculate(**scenario))
+                continue
+            num_months, _ = self._resolve_term(scenario.get('term'), scenario.get('term_months'))
+            key = (scenario.get('risk_profile'), num_months)
+            if key not in shocks_by_key:
+                shocks_by_key[key] = self._draw_shocks(self._make_rng(*key), num_months)
+            results.append(self.calculate(**scenario, random_shocks=shocks_by_key[key]))
+        return results
+
+    def _resolve_term(self, term, term_months):
+        """Возвращает (число месяцев, срок в годах) по term_months или term."""
+        if term_months:
+            return term_months, round(term_months / 12, 1)
+        return (term or 1) * 12, term
+
+    def _resolve_engine(self, forecast_engine, num_months, annual_volatility):
+        """'auto' -> 'analytic', если логнормальная аппроксимация достаточно точна, иначе 'mc'."""
+        if forecast_engine == 'auto':
+            log_variance = (annual_volatility / 100) ** 2 * num_months / 12
+            return 'analytic' if log_variance <= ANALYTIC_AUTO_MAX_LOG_VARIANCE else 'mc'
+        return forecast_engine
+
+    def _make_rng(self, *key_parts):
+        """
+        Генератор случайных чисел с зерном, выведенным из ключа (риск-профиль, срок, ...).
+        Одинаковые входные данные всегда дают одинаковый прогноз: попадание в кэш
+        и повторный расчет неотличимы, а сценарии одного профиля и срока
+        автоматически считаются на общих случайных шоках.
+        """
+        digest = hashlib.sha256("|".join(map(str, key_parts)).encode()).digest()
+        return np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+
+    @timed_stage('no_loss_search')
+    def _find_no_loss_composition(self, initial_composition: dict, catalog, amount: int, num_months: int, monthly_contribution: int = 0,
+                                  seed_key=None, precision: float = None) -> dict:
+        """
+        Ищет минимальный сдвиг доли в облигации, при котором пессимистичный прогноз
+        (5-й перцентиль) на конец срока не ниже суммы вложений.
+
+        Все кандидаты считаются на одном наборе шоков одним векторизованным пакетом:
+        сначала грубая сетка с шагом NO_LOSS_GRID_STEP_PERCENT, затем мелкая сетка
+        внутри найденного интервала с точностью precision (NO_LOSS_PRECISION_PERCENT).
+        Если seed_key совпадает с ключом итогового прогноза, найденный состав
+        гарантированно проходит условие и на графике.
+        """
+        precision = precision or NO_LOSS_PRECISION_PERCENT
+        bonds_share = initial_composition.get('bonds', 0)
+        total_risky_share = sum(v for k, v in initial_composition.items() if k != 'bonds')
+        max_shift = max(0.0, min(total_risky_share, NO_LOSS_MAX_BONDS_PERCENT - bonds_share))
+        total_invested = amount + (monthly_contribution * num_months)
+
+        rng = self._make_rng(*seed_key) if seed_key else np.random.default_rng()
+        random_shocks = self._draw_shocks(rng, num_months)
+        min_percentile, _ = self._get_percentile_bounds('no-loss')
+
+        def evaluate(shifts):
+            compositions = [self._shift_to_bonds(initial_composition, shift) for shift in shifts]
+            metrics = []
+            for composition in compositions:
+                temp_strategy = {"composition": composition}
+                metrics.append(self._calculate_portfolio_metrics(self._assemble_portfolio(temp_strategy, catalog), temp_strategy))
+            annual_returns, annual_volatilities = np.array(metrics).T
+            final_capital = self._simulate_final_capital(amount, monthly_contribution, annual_returns, annual_volatilities, random_shocks)
+            return self._select_percentiles(final_capital, [min_percentile])[:, 0]
+
+        coarse_shifts = np.linspace(0, max_shift, int(math.ceil(max_shift / NO_LOSS_GRID_STEP_PERCENT)) + 1)
+        coarse_min = evaluate(coarse_shifts)
+        feasible = coarse_min >= total_invested
+        debug_log(f"Грубая сетка: сдвиг в облигации {np.round(coarse_shifts, 1).tolist()} п.п., мин. прогноз {np.round(coarse_min).tolist()} ₽ (Цель: >= {total_invested:,.0f} ₽)")
+
+        if not feasible.any():
+            debug_log(f"--- ⚠️ Достигнут лимит облигаций ({NO_LOSS_MAX_BONDS_PERCENT:.0f}%). Возвращаем самую безопасную из возможных композиций. ---")
+            return self._shift_to_bonds(initial_composition, max_shift)
+
+        first_feasible = int(np.argmax(feasible))
+        if first_feasible == 0:
+            debug_log("--- ✅ Условие безубыточности выполнено без изменения состава. ---")
+            return self._shift_to_bonds(initial_composition, 0.0)
+
+        low, high = coarse_shifts[first_feasible - 1], coarse_shifts[first_feasible]
+        fine_shifts = np.linspace(low, high, int(math.ceil((high - low) / precision)) + 1)[1:]
+        fine_feasible = evaluate(fine_shifts) >= total_invested
+        # Правая граница интервала допустима по построению (те же шоки), так что решение есть всегда
+        best_shift = fine_shifts[int(np.argmax(fine_feasible))] if fine_feasible.any() else high
+        debug_log(f"--- ✅ Условие безубыточности достигнуто при сдвиге {best_shift:.2f} п.п. в облигации. ---")
+        return self._shift_to_bonds(initial_composition, float(best_shift))
+
+    def _shift_to_bonds(self, composition: dict, shift: float) -> dict:
+        """Переносит shift п.п. в облигации, уменьшая рисковые доли пропорционально."""
+        total_risky_share = sum(v for k, v in composition.items() if k != 'bonds')
+        risky_scale = (total_risky_share - shift) / total_risky_share if total_risky_share > 0 else 0.0
+        shifted = {k: (v + shift if k == 'bonds' else v * risky_scale) for k, v in composition.items()}
+        shifted.setdefault('bonds', shift)
+        return shifted
+
+    def _simulate_final_capital(self, amount, monthly_contribution, annual_returns, annual_volatilities, random_shocks):
+        """
+        Капитал на конец срока для K кандидатов сразу (массив K x N) на общих шоках.
+        V_T = G_T * (A + c * sum_{k<T} 1/G_k), как и в _advance_paths.
+        """
+        monthly_returns, monthly_volatilities = self._monthly_parameters(np.asarray(annual_returns), np.asarray(annual_volatilities))
+        growth = np.cumprod(1 + monthly_returns[:, None, None] + random_shocks[None] * monthly_volatilities[:, None, None], axis=1)
+        final_capital = np.full(growth.shape[::2], float(amount))
+        if monthly_contribution:
+            final_capital += monthly_contribution * (1 / growth[:, :-1]).sum(axis=1)
+        return final_capital * growth[:, -1]
+
+    def _assemble_portfolio(self, strategy_template, catalog, selected_funds=None):
+        """Фонды портфеля по индексам снимка каталога: O(k) от размера портфеля."""
         if selected_funds:
-            for fund_name in selected_funds:
-                found = next((f for f in all_funds if f['name'] == fund_name), None)
-                if found: portfolio.append(found)
-            return portfolio
-        else:
-            used_funds = set()
-            for risk_level, _ in strategy_template['composition'].items():
-                candidates = [f for f in all_funds if f.get('risk_level') == risk_level and f['name'] not in used_funds]
-                if candidates:
-                    candidates.sort(key=lambda x: x['annual_return_percent'], reverse=True)
-                    best_fund = candidates[0]
-                    portfolio.append(best_fund)
-                    used_funds.add(best_fund['name'])
-            return portfolio
+            return catalog.find_funds(selected_funds)
+        return list(catalog.best_funds_for_levels(strategy_template['composition']))
 
     def _calculate_portfolio_metrics(self, portfolio_composition, strategy_template):
-        total_return = 0
-        total_volatility = 0
-        risk_to_fund_map = {fund.get('risk_level'): fund for fund in portfolio_composition}
-
-        for risk_level, percentage in strategy_template['composition'].items():
-            fund_for_level = risk_to_fund_map.get(risk_level)
-            if fund_for_level:
-                share_fraction = percentage / 100.0
-                total_return += fund_for_level['annual_return_percent'] * share_fraction
-                total_volatility += fund_for_level['volatility_percent'] * share_fraction
-        
-        return total_return, total_volatility
+        return portfolio_metrics(portfolio_composition, strategy_template['composition'])
 
     def _get_final_composition_details(self, portfolio_composition, strategy_template):
         final_composition = []
@@ -176,74 +409,279 @@ class PortfolioCalculator:
         return final_composition
     
     # --- NEW: Method to calculate deposit growth ---
+    @timed_stage('deposit_forecast')
     def _generate_deposit_forecast(self, amount, num_months, monthly_contribution=0):
-        """Calculates the growth of a deposit with monthly capitalization."""
+        """
+        Рост вклада с ежемесячной капитализацией (пополнение в начале месяца).
+        Считается в закрытой форме: C_t = A*q^t + m*q*(q^t - 1)/(q - 1), где q = 1 + r.
+        """
         monthly_rate = (DEPOSIT_ANNUAL_RATE_PERCENT / 100) / 12
-        capital_over_time = [float(amount)]
-
-        current_capital = float(amount)
-        for _ in range(num_months):
-            # Add contribution at the beginning of the month
-            current_capital += monthly_contribution
-            # Calculate interest on the new capital
-            interest = current_capital * monthly_rate
-            current_capital += interest
-            capital_over_time.append(current_capital)
-        
-        # The first value is at month 0, so we need num_months + 1 total values.
-        # The loop runs num_months times, adding one value each time.
-        # Initial amount is already there. So the length is correct.
-        # Let's adjust to match the length of forecast labels.
-        if len(capital_over_time) == num_months + 1:
-             return capital_over_time
-        # In case of any mismatch, let's build it safely.
-        final_capital = [float(amount)]
-        c = float(amount)
-        for i in range(1, num_months + 1):
-            c += monthly_contribution
-            c *= (1 + monthly_rate)
-            final_capital.append(c)
-        return final_capital
-
-    def _generate_forecast_monte_carlo(self, amount, num_months, annual_return, annual_volatility, monthly_contribution=0, risk_profile='moderate'): # <-- НОВЫЙ ПАРАМЕТР
+        growth = (1 + monthly_rate) ** np.arange(num_months + 1)
+        if monthly_rate > 0:
+            contributions = monthly_contribution * (1 + monthly_rate) * (growth - 1) / monthly_rate
+        else:
+            contributions = monthly_contribution * np.arange(num_months + 1, dtype=float)
+        return float(amount) * growth + contributions
+
+    def _generate_forecast_monte_carlo(self, amount, num_months, annual_return, annual_volatility, monthly_contribution=0, risk_profile='moderate',
+                                       forecast_mode=None, extra_percentiles=None, random_shocks=None, seed_key=None): # <-- НОВЫЙ ПАРАМЕТР
+        monthly_return, monthly_volatility = self._monthly_parameters(annual_return, annual_volatility)
+
+        min_percentile, max_percentile = self._get_percentile_bounds(risk_profile)
+        extra_percentiles = list(extra_percentiles or [])
+        percentiles = [min_percentile, max_percentile] + extra_percentiles
+        forecast_mode = forecast_mode or FORECAST_MODE
+        rng = self._make_rng(*seed_key) if seed_key else np.random.default_rng()
+
+        if random_shocks is None and forecast_mode == 'basis' and seed_key:
+            basis = self._get_basis_paths(num_months, monthly_return, monthly_volatility, seed_key)
+            avg_data, bands = self._combine_basis_paths(basis, amount, monthly_contribution, percentiles)
+        elif random_shocks is None and forecast_mode == 'streaming':
+            avg_data, bands = self._reduce_paths_streaming(amount, num_months, monthly_return, monthly_volatility, monthly_contribution, percentiles, rng)
+        else:
+            # Все шоки разыгрываются одним блоком: строка t-1 — доходности месяца t.
+            # Заранее заданные шоки (общие для пакета сценариев) всегда идут через матрицу.
+            if random_shocks is None:
+                random_shocks = self._draw_shocks(rng, num_months)
+            simulations_matrix = self._simulate_paths(amount, monthly_contribution, monthly_return, monthly_volatility, random_shocks)
+            # --- КЛЮЧЕВОЕ ИЗМЕНЕНИЕ: Используем среднее арифметическое вместо медианы ---
+            avg_data = simulations_matrix.mean(axis=1)
+            bands = self._select_percentiles(simulations_matrix, percentiles)
+
+        return self._forecast_payload(num_months, avg_data, bands, extra_percentiles)
+
+    def _generate_forecast_analytic(self, amount, num_months, annual_return, annual_volatility, monthly_contribution=0, risk_profile='moderate',
+                                    extra_percentiles=None):
+        """
+        Аналитический прогноз без симуляции, в том же формате, что и Монте-Карло.
+
+        Для той же модели (независимые месячные доходности, взнос со 2-го месяца)
+        первые два момента капитала считаются точно рекуррентно:
+            E[V_t]   = (E[V_{t-1}] + c) * m1,
+            E[V_t^2] = (E[V_{t-1}^2] + 2c*E[V_{t-1}] + c^2) * m2,
+        где m1 = 1 + mu, m2 = (1 + mu)^2 + sigma^2. Перцентили берутся
+        у логнормального распределения с такими же средним и дисперсией.
+        """
+        monthly_return, monthly_volatility = self._monthly_parameters(annual_return, annual_volatility)
+        growth_m1 = 1 + monthly_return
+        growth_m2 = growth_m1 ** 2 + monthly_volatility ** 2
+
+        means = np.empty(num_months + 1)
+        second_moments = np.empty(num_months + 1)
+        mean, second_moment = float(amount), float(amount) ** 2
+        means[0], second_moments[0] = mean, second_moment
+        for t in range(1, num_months + 1):
+            contribution = monthly_contribution if t > 1 else 0
+            second_moment = (second_moment + 2 * contribution * mean + contribution ** 2) * growth_m2
+            mean = (mean + contribution) * growth_m1
+            means[t], second_moments[t] = mean, second_moment
+
+        min_percentile, max_percentile = self._get_percentile_bounds(risk_profile)
+        extra_percentiles = list(extra_percentiles or [])
+        bands = self._lognormal_percentiles(means, second_moments, [min_percentile, max_percentile] + extra_percentiles)
+
+        return self._forecast_payload(num_months, means, bands, extra_percentiles)
+
+    @staticmethod
+    def _forecast_payload(num_months, avg_data, bands, extra_percentiles):
+        """
+        Прогноз в формате ответа API. Ряды остаются массивами NumPy (непрерывными,
+        без перевода в списки): их напрямую сериализует codec.dumps.
+        """
+        bands = np.ascontiguousarray(bands.T)
+        forecast = {
+            "labels": list(range(num_months + 1)),
+            "avg": np.ascontiguousarray(avg_data),
+            "min": bands[0],
+            "max": bands[1]
+        }
+        if extra_percentiles:
+            forecast["bands"] = {f"p{q:g}": bands[i + 2] for i, q in enumerate(extra_percentiles)}
+        return forecast
+
+    def _lognormal_percentiles(self, means, second_moments, percentiles):
+        """Перцентили логнормального распределения с заданными средним и вторым моментом."""
+        z_scores = np.array([NormalDist().inv_cdf(q / 100) for q in percentiles])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_variance = np.log(np.maximum(second_moments / means ** 2, 1.0))
+            log_mean = np.log(means) - log_variance / 2
+            bands = np.exp(log_mean[:, None] + np.sqrt(log_variance)[:, None] * z_scores)
+        # Нулевой или вырожденный капитал (например, сумма 0 в 1-м месяце) — без разброса
+        degenerate = ~(means > 0) | ~np.isfinite(bands).all(axis=1)
+        bands[degenerate] = means[degenerate, None]
+        return bands
+
+    def _get_basis_paths(self, num_months, monthly_return, monthly_volatility, seed_key):
+        """
+        Единичные пути для фиксированной реализации шоков: A — капитал при сумме 1
+        без пополнений, B — капитал при нулевой сумме и пополнении 1 в месяц.
+        Любой прогноз с теми же шоками равен amount*A + contribution*B, поэтому
+        пути считаются один раз на (состав стратегии, срок) и затем переиспользуются.
+        """
+        key = (seed_key, num_months, monthly_return, monthly_volatility, self.num_simulations, self.sampling_method)
+        basis = self._basis_cache.get(key)
+        if basis is None:
+            random_shocks = self._draw_shocks(self._make_rng(*seed_key), num_months)
+            unit_amount = self._simulate_paths(1.0, 0, monthly_return, monthly_volatility, random_shocks)
+            unit_contribution = self._simulate_paths(0.0, 1.0, monthly_return, monthly_volatility, random_shocks)
+            basis = {
+                "amount": unit_amount,
+                "contribution": unit_contribution,
+                "amount_mean": unit_amount.mean(axis=1),
+                "contribution_mean": unit_contribution.mean(axis=1),
+                # (уровни, отношение пополнения к сумме) -> перцентили путей A + отношение*B
+                "unit_percentiles": ForecastCache(max_size=BASIS_BANDS_CACHE_SIZE)
+            }
+            self._basis_cache.put(key, basis)
+        return basis
+
+    def _combine_basis_paths(self, basis, amount, monthly_contribution, percentiles):
+        """
+        Среднее и перцентили для amount*A + contribution*B без повторной симуляции.
+        Перцентили при положительной сумме масштабируются вместе с ней: они равны
+        amount * перцентили(A + (contribution/amount)*B), и таблица для отношения
+        contribution/amount кэшируется при наборе путей (без пополнений отношение 0).
+        """
+        avg_data = amount * basis["amount_mean"] + monthly_contribution * basis["contribution_mean"]
+        if amount > 0:
+            scale, ratio = amount, monthly_contribution / amount
+        elif amount == 0:
+            scale, ratio = monthly_contribution, None
+        else:
+            return avg_data, self._combine_percentiles(basis, amount, monthly_contribution, percentiles)
+
+        key = (tuple(percentiles), ratio)
+        unit_bands = basis["unit_percentiles"].get(key)
+        if unit_bands is None:
+            unit_bands = self._combine_percentiles(basis, *((0.0, 1.0) if ratio is None else (1.0, ratio)), percentiles)
+            basis["unit_percentiles"].put(key, unit_bands)
+        return avg_data, scale * unit_bands
+
+    def _combine_percentiles(self, basis, amount_weight, contribution_weight, percentiles):
+        """Перцентили amount_weight*A + contribution_weight*B блоками по BASIS_COMBINE_CHUNK_MONTHS строк."""
+        unit_amount, unit_contribution = basis["amount"], basis["contribution"]
+        bands = np.empty((len(unit_amount), len(percentiles)))
+        for start in range(0, len(unit_amount), BASIS_COMBINE_CHUNK_MONTHS):
+            rows = slice(start, start + BASIS_COMBINE_CHUNK_MONTHS)
+            if not contribution_weight:
+                paths = unit_amount[rows] * amount_weight
+            else:
+                paths = unit_contribution[rows] * contribution_weight
+                if amount_weight:
+                    paths += unit_amount[rows] * amount_weight
+            bands[rows] = self._select_percentiles(paths, percentiles)
+        return bands
+
+    def _reduce_paths_streaming(self, amount, num_months, monthly_return, monthly_volatility, monthly_contribution, percentiles, rng):
+        """
+        Потоковый прогноз: пути продвигаются блоками по STREAMING_CHUNK_MONTHS месяцев,
+        а среднее и перцентили считаются сразу по каждому блоку. В памяти живет только
+        текущий блок, поэтому пиковая память не зависит от срока.
+        """
+        avg_data = np.empty(num_months + 1)
+        bands = np.empty((num_months + 1, len(percentiles)))
+        avg_data[0] = amount
+        bands[0] = amount
+
+        capital = np.full(self.num_simulations, float(amount))
+        for start, random_shocks in self._iter_shock_chunks(rng, num_months, STREAMING_CHUNK_MONTHS):
+            chunk_months = len(random_shocks)
+            paths = self._advance_paths(capital, monthly_contribution, monthly_return, monthly_volatility, random_shocks, first_month=(start == 0))
+            avg_data[start + 1:start + 1 + chunk_months] = paths.mean(axis=1)
+            bands[start + 1:start + 1 + chunk_months] = self._select_percentiles(paths, percentiles)
+            capital = paths[-1]
+        return avg_data, bands
+
+    @timed_stage('shock_draw')
+    def _draw_shocks(self, rng, num_months):
+        """
+        Стандартные нормальные шоки (num_months, num_simulations) выбранным способом.
+        Путь j — это столбец j; для 'sobol' каждый путь — точка Соболя размерности num_months.
+        """
+        num_simulations = self.num_simulations
+        if self.sampling_method == 'antithetic':
+            half = rng.standard_normal((num_months, (num_simulations + 1) // 2))
+            return np.concatenate([half, -half], axis=1)[:, :num_simulations]
+        if self.sampling_method == 'sobol' and num_months > 0:
+            try:
+                sobol = qmc.Sobol(d=num_months, scramble=True, rng=rng)
+            except TypeError:  # scipy < 1.15
+                sobol = qmc.Sobol(d=num_months, scramble=True, seed=rng)
+            # Сдвиг от 0 и 1, чтобы обратная функция распределения оставалась конечной
+            points = np.clip(sobol.random(num_simulations), 1e-12, 1 - 1e-12)
+            return ndtri(points).T
+        return rng.standard_normal((num_months, num_simulations))
+
+    def _iter_shock_chunks(self, rng, num_months, chunk_months):
+        """Шоки блоками по chunk_months месяцев: (номер первого месяца блока, блок)."""
+        if self.sampling_method == 'sobol':
+            # Точки Соболя задают весь путь сразу, поэтому генерируются целиком и режутся
+            random_shocks = self._draw_shocks(rng, num_months)
+            for start in range(0, num_months, chunk_months):
+                yield start, random_shocks[start:start + chunk_months]
+            return
+        for start in range(0, num_months, chunk_months):
+            yield start, self._draw_shocks(rng, min(chunk_months, num_months - start))
+
+    def _simulate_paths(self, amount, monthly_contribution, monthly_return, monthly_volatility, random_shocks):
+        """Строит полную матрицу капитала (num_months + 1, N), строка 0 — стартовая сумма."""
+        num_months, num_simulations = random_shocks.shape
+        simulations_matrix = np.empty((num_months + 1, num_simulations))
+        simulations_matrix[0] = amount
+        if num_months > 0:
+            simulations_matrix[1:] = self._advance_paths(amount, monthly_contribution, monthly_return, monthly_volatility, random_shocks, first_month=True)
+        return simulations_matrix
+
+    @timed_stage('path_advance')
+    def _advance_paths(self, start_capital, monthly_contribution, monthly_return, monthly_volatility, random_shocks, first_month=False):
+        """
+        Продвигает пути на len(random_shocks) месяцев без помесячного цикла.
+
+        Рекуррентность V_t = (V_{t-1} + c)*g_t раскрывается через накопленный рост
+        G_t = g_1*...*g_t:  V_t = G_t * (V_0 + c * sum_{j<=t} 1/G_{j-1}), G_0 = 1.
+        Для first_month=True взнос в 1-м месяце не делается: доход за 1-й месяц
+        начисляется только на стартовый капитал, как и раньше.
+        """
+        growth = np.cumprod(1 + monthly_return + random_shocks * monthly_volatility, axis=0)
+        paths = np.empty_like(growth)
+        paths[:] = start_capital
+        if monthly_contribution:
+            if not first_month:
+                paths += monthly_contribution
+            # Взнос месяца j растет вместе с капиталом начиная с месяца j
+            paths[1:] += np.cumsum(monthly_contribution / growth[:-1], axis=0)
+        paths *= growth
+        return paths
+
+    @timed_stage('percentiles')
+    def _select_percentiles(self, paths, percentiles):
+        """
+        Перцентили по строкам матрицы (как np.percentile с линейной интерполяцией),
+        но через одно частичное упорядочивание np.partition для всех уровней сразу.
+        Возвращает массив (число строк, len(percentiles)).
+        """
+        num_simulations = paths.shape[1]
+        positions = np.asarray(percentiles, dtype=float) / 100 * (num_simulations - 1)
+        lower = np.floor(positions).astype(int)
+        upper = np.ceil(positions).astype(int)
+        partitioned = np.partition(paths, np.unique(np.concatenate([lower, upper])), axis=1)
+        lower_values = partitioned[:, lower]
+        return lower_values + (partitioned[:, upper] - lower_values) * (positions - lower)
+
+    def _monthly_parameters(self, annual_return, annual_volatility):
+        """Годовые доходность и волатильность (в %) -> месячные доли (скаляры или массивы)."""
         monthly_return = (1 + annual_return / 100)**(1/12) - 1
         monthly_volatility = annual_volatility / math.sqrt(12) / 100
+        return monthly_return, monthly_volatility
 
-        simulations_matrix = np.zeros((num_months + 1, NUM_SIMULATIONS))
-        simulations_matrix[0] = amount
-        
-        # --- КЛЮЧЕВОЕ ИЗМЕНЕНИЕ: Доход за 1-й мес. только на стартовый капитал ---
-        random_shocks_first_month = np.random.normal(0, 1, NUM_SIMULATIONS)
-        monthly_returns_first_month = monthly_return + random_shocks_first_month * monthly_volatility
-        simulations_matrix[1] = simulations_matrix[0] * (1 + monthly_returns_first_month)
-
-        for t in range(2, num_months + 1):
-            random_shocks = np.random.normal(0, 1, NUM_SIMULATIONS)
-            monthly_returns = monthly_return + random_shocks * monthly_volatility
-            previous_capital = simulations_matrix[t-1]
-            capital_with_contribution = previous_capital + monthly_contribution
-            simulations_matrix[t] = capital_with_contribution * (1 + monthly_returns)
-
-        labels = list(range(num_months + 1))
-        
+    def _get_percentile_bounds(self, risk_profile):
         # --- ИЗМЕНЕНИЕ: Динамический выбор перцентилей ---
         if risk_profile in ['moderate', 'moderate-conservative', 'moderate-aggressive']:
-            min_percentile = 15
-            max_percentile = 85
-        else: # conservative, aggressive, no-loss
-            min_percentile = 5
-            max_percentile = 95
-            
-        min_data = np.percentile(simulations_matrix, min_percentile, axis=1).tolist()
-        # --- КЛЮЧЕВОЕ ИЗМЕНЕНИЕ: Используем среднее арифметическое вместо медианы ---
-        avg_data = np.mean(simulations_matrix, axis=1).tolist()
-        # avg_data = np.percentile(simulations_matrix, 50, axis=1).tolist()
-        max_data = np.percentile(simulations_matrix, max_percentile, axis=1).tolist()
-
-        return {"labels": labels, "avg": avg_data, "min": min_data, "max": max_data}
-
+            return 15, 85
+        # conservative, aggressive, no-loss
+        return 5, 95
 
     def _generate_monthly_income_forecast(self, capital_forecast: list):
         rate = PASSIVE_INCOME_RATE_PERCENT / 100.0
-        return [ (capital * rate) / 12 for capital in capital_forecast ]
+        return np.asarray(capital_forecast, dtype=float) * (rate / 12)
 
@@ -0,0 +1,78 @@
+# portfolio_bot/domain/compact_payload.py
+# Компактный формат ответа /api/calculate (включается параметром ?format=compact).
+#
+# Отличия от полного ответа:
+#   - forecast.labels не передается: это всегда 0..months, вместо него forecast.months;
+#   - ряды (forecast.avg/min/max/bands, deposit_forecast, monthly_income_forecast)
+#     закодированы одним из способов ENCODINGS:
+#       'fixed'  — список целых рублей (значения округлены до рубля);
+#       'delta'  — то же, но первое значение, затем приращения к предыдущему (короткие целые);
+#       'f32'    — base64 от массива float32 (little-endian): ~7 значащих цифр, самый короткий
+#                  без сжатия, но хуже сжимается gzip, чем 'delta';
+#   - composition ссылается на фонды по fund_id — позиции фонда в списке /api/funds
+#     версии catalog_version; название и purchase_url клиент берет из закэшированного списка.
+import base64
+
+import numpy as np
+
+COMPACT_FORMAT = 'compact-v1'
+ENCODINGS = ('fixed', 'delta', 'f32')
+DEFAULT_ENCODING = 'delta'
+SERIES_FIELDS = ('deposit_forecast', 'monthly_income_forecast')
+
+
+def encode_series(values, encoding: str = DEFAULT_ENCODING):
+    """Кодирует ряд значений прогноза (см. ENCODINGS)."""
+    array = np.asarray(values, dtype=float)
+    if encoding == 'f32':
+        return base64.b64encode(array.astype('<f4').tobytes()).decode('ascii')
+    rounded = np.rint(array).astype(np.int64)
+    if encoding == 'delta':
+        return np.diff(rounded, prepend=0).tolist()
+    return rounded.tolist()
+
+
+def decode_series(encoded, encoding: str = DEFAULT_ENCODING) -> list:
+    """Обратное преобразование encode_series (для тестов клиента и бенчмарков)."""
+    if encoding == 'f32':
+        return np.frombuffer(base64.b64decode(encoded), dtype='<f4').astype(float).tolist()
+    if encoding == 'delta':
+        return np.cumsum(encoded, dtype=np.int64).tolist()
+    return list(encoded)
+
+
+def compact_result(result: dict, catalog, encoding: str = DEFAULT_ENCODING) -> dict:
+    """
+    Переводит результат PortfolioCalculator.calculate в компактный формат.
+    Ответы с ошибкой возвращаются без изменений.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Неизвестный способ кодирования: {encoding}")
+    if "error" in result:
+        return result
+
+    compact = dict(result)
+    compact["format"] = COMPACT_FORMAT
+    compact["encoding"] = encoding
+    compact["catalog_version"] = catalog.version
+
+    forecast = result["forecast"]
+    compact_forecast = {
+        "months": len(forecast["labels"]) - 1,
+        "avg": encode_series(forecast["avg"], encoding),
+        "min": encode_series(forecast["min"], encoding),
+        "max": encode_series(forecast["max"], encoding),
+    }
+    if "bands" in forecast:
+        compact_forecast["bands"] = {name: encode_series(band, encoding) for name, band in forecast["bands"].items()}
+    compact["forecast"] = compact_forecast
+
+    for field in SERIES_FIELDS:
+        if result.get(field) is not None:
+            compact[field] = encode_series(result[field], encoding)
+
+    compact["composition"] = [
+        {"fund_id": catalog.fund_ids[item["fund_name"]], "percentage": item["percentage"], "risk_level": item["risk_level"]}
+        for item in result["composition"]
+    ]
+    return compact
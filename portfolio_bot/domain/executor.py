@@ -0,0 +1,445 @@
+# portfolio_bot/domain/executor.py
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from .calculator import PortfolioCalculator
+from .forecast_cache import ForecastCache
+from .metrics import METRICS
+
+BACKENDS = ('inline', 'thread', 'process')
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_TASK_TIMEOUT_SECONDS = 10.0
+# Уровни обслуживания под нагрузкой: (имя, движок прогноза). Имя уровня ниже полного
+# попадает в ответ полем "service_level"
+DEGRADATION_LEVELS = (('full', None), ('reduced', 'auto'), ('analytic', 'analytic'))
+# Уровень выбирается по загрузке при приеме задачи: (принятые задачи) / (число воркеров).
+# До первого порога задачи не ждут воркера, дальше очередь растет и расчеты дешевеют
+DEGRADATION_LOAD_FACTORS = (1.0, 2.0)
+
+# Калькулятор процесса-воркера (создается один раз в _init_process_worker)
+_worker_calculator = None
+
+METRICS.describe('portfolio_coalesced_requests_total',
+                 'Число расчетов, которые дождались такого же уже идущего расчета вместо своего')
+METRICS.describe('portfolio_admissions_total', 'Число принятых расчетов по уровню обслуживания')
+METRICS.describe('portfolio_admission_rejected_total', 'Число расчетов, отклоненных из-за переполнения очереди')
+
+
+class CalculationRejected(Exception):
+    """Очередь расчетов заполнена: запрос не принят, клиенту стоит повторить через retry_after секунд."""
+
+    def __init__(self, message: str = "Очередь расчетов переполнена", retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CalculationTimeout(Exception):
+    """Расчет не уложился в таймаут задачи."""
+
+
+def _init_process_worker(calculator_settings: dict):
+    """Инициализатор процесса пула: загружает каталог, сетку и кэш один раз на воркер."""
+    global _worker_calculator
+    from ..database.repository import CombinedRepository
+    from .forecast_grid import ForecastGrid
+
+    repository = CombinedRepository()
+    grid = ForecastGrid.load(catalog_version=repository.get_catalog_version()) if calculator_settings.get('use_grid') else None
+    _worker_calculator = PortfolioCalculator(
+        repository,
+        cache=ForecastCache() if calculator_settings.get('use_cache') else None,
+        grid=grid,
+        num_simulations=calculator_settings.get('num_simulations'),
+        sampling_method=calculator_settings.get('sampling_method')
+    )
+    print(f"[ПУЛ] Воркер {os.getpid()} готов к расчетам.")
+
+
+def _degrade(kwargs: dict, engine: str) -> dict:
+    """Аргументы расчета с более дешевым движком прогноза (запрошенный более дешевый сохраняется)."""
+    requested = kwargs.get('forecast_engine')
+    if requested == 'analytic' or requested == engine:
+        return kwargs
+    return {**kwargs, 'forecast_engine': engine}
+
+
+def _mark_level(result: dict, level_name: str) -> dict:
+    # Результат может лежать в кэше: помечается копия
+    return result if 'error' in result else {**result, 'service_level': level_name}
+
+
+def _execute(calculator: PortfolioCalculator, method: str, args: tuple, kwargs: dict, level: int):
+    """
+    Вызов calculate()/calculate_estimate()/calculate_batch() на уровне обслуживания level
+    (см. DEGRADATION_LEVELS).
+    """
+    level_name, engine = DEGRADATION_LEVELS[level]
+    if engine is None:
+        return getattr(calculator, method)(*args, **kwargs)
+    if method != 'calculate_batch':
+        return _mark_level(getattr(calculator, method)(*args, **_degrade(kwargs, engine)), level_name)
+    scenarios = args[0] if args else kwargs['scenarios']
+    results = calculator.calculate_batch([_degrade(scenario, engine) for scenario in scenarios])
+    return [_mark_level(result, level_name) for result in results]
+
+
+def _calculate_in_worker(method: str, args: tuple, kwargs: dict, level: int = 0):
+    return _execute(_worker_calculator, method, args, kwargs, level)
+
+
+class CalculationExecutor:
+    """
+    Запускает расчеты PortfolioCalculator на выбранном бэкенде:
+      'inline'  — в потоке запроса (как раньше);
+      'thread'  — в пуле потоков;
+      'process' — в пуле процессов, каждый со своим калькулятором, каталогом и кэшем.
+    Число одновременно принятых задач ограничено queue_size (сверх него — CalculationRejected
+    с оценкой, когда повторить), каждая задача ждется не дольше task_timeout секунд.
+    С 'inline' одновременно считается не больше max_workers расчетов, остальные ждут.
+    Когда принятых задач больше, чем воркеров, новые считаются дешевле (degrade=True,
+    см. DEGRADATION_LEVELS): задержка остается ограниченной, а не растет у всех сразу.
+    Интерфейс расчета не меняется: calculate()/calculate_batch() принимают те же аргументы.
+    Для asyncio-серверов есть calculate_async()/calculate_batch_async(): они ждут
+    результат, не занимая ни поток, ни цикл событий.
+    Пул создается в том процессе, который им пользуется: после fork (pre-fork сервер,
+    см. gunicorn_conf.py) каждый воркер получает свой пул и свою очередь.
+
+    Одинаковые одновременные calculate() (ключ — PortfolioCalculator.request_key)
+    считаются один раз: пока расчет идет, следующие такие же запросы ждут его результат
+    и не занимают слот очереди. Результат общий, поэтому его нельзя менять.
+
+    Объединяются только запросы одного уровня обслуживания: ключ строится по аргументам
+    после деградации, поэтому запрос полного уровня не получит упрощенный результат.
+
+    calculate_progressive()/calculate_progressive_async() отдают расчет по шагам, от грубой
+    оценки к полному результату (см. PortfolioCalculator.calculate_progressive). Поток
+    занимает один слот очереди, а каждый его шаг — отдельная задача того же бэкенда,
+    поэтому вместе с обычными расчетами одновременно считается не больше max_workers.
+
+    max_workers и queue_size стоит задавать под реальный параллелизм процесса: в pre-fork
+    сервере запросов в воркере не больше, чем его потоков (см. gunicorn_conf.py), и при
+    queue_size больше этого числа отказы и деградация не наступят никогда.
+    """
+
+    def __init__(self, calculator: PortfolioCalculator, backend: str = 'inline', max_workers: int = None,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, task_timeout: float = DEFAULT_TASK_TIMEOUT_SECONDS,
+                 degrade: bool = True):
+        if backend not in BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд расчетов: {backend}")
+        self.calculator = calculator
+        self.backend = backend
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.task_timeout = task_timeout
+        self.queue_size = queue_size
+        self.degrade = degrade
+        self._pool_lock = threading.Lock()
+        self._pool_pid = None
+        self._pool = None
+        # Принятые и еще не завершенные задачи (считаются и ждут) и средняя длительность задачи
+        self._admission_lock = threading.Lock()
+        self._in_system = 0
+        self._average_seconds = 0.0
+        # Ограничение одновременных расчетов для 'inline' (для пулов его задает размер пула)
+        self._running = threading.BoundedSemaphore(self.max_workers)
+        # Идущие расчеты: ключ запроса -> [future, число ожидающих]
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        if backend != 'inline':
+            self._get_pool()
+
+    def _create_pool(self):
+        if self.backend == 'thread':
+            return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='calculator')
+        calculator_settings = {
+            "use_cache": self.calculator.cache is not None,
+            "use_grid": self.calculator.grid is not None,
+            "num_simulations": self.calculator.num_simulations,
+            "sampling_method": self.calculator.sampling_method,
+        }
+        return ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_process_worker,
+                                   initargs=(calculator_settings,))
+
+    def _get_pool(self):
+        """Пул текущего процесса: потоки и процессы родителя после fork недоступны, поэтому создается свой."""
+        if self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = self._create_pool()
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def calculate(self, *args, **kwargs) -> dict:
+        return self._run('calculate', args, kwargs)
+
+    def calculate_batch(self, *args, **kwargs) -> list:
+        return self._run('calculate_batch', args, kwargs)
+
+    async def calculate_async(self, *args, **kwargs) -> dict:
+        return await self._run_async('calculate', args, kwargs)
+
+    async def calculate_batch_async(self, *args, **kwargs) -> list:
+        return await self._run_async('calculate_batch', args, kwargs)
+
+    def calculate_progressive(self, **kwargs):
+        """
+        Генератор (событие, число путей, результат). Прием в очередь (CalculationRejected)
+        происходит на первом шаге, поэтому отказ можно вернуть обычным ответом до начала потока.
+        Шаг, не начавшийся за task_timeout секунд после приема, — CalculationTimeout.
+        """
+        level = self._service_level()
+        level_name, engine = DEGRADATION_LEVELS[level]
+        admitted_at = self._enter(level)
+        deadline = admitted_at + self.task_timeout
+        try:
+            # Промежуточные оценки не нужны, если полный результат уже в кэше
+            plan = self.calculator.progressive_plan(**(kwargs if engine is None else _degrade(kwargs, engine)))
+            for num_simulations in plan:
+                estimate = self._run_step('calculate_estimate', (num_simulations,), kwargs, level, deadline)
+                if 'error' in estimate or estimate['forecast_engine'] != 'mc':
+                    break
+                yield 'estimate', num_simulations, estimate
+            yield 'result', self.calculator.num_simulations, self._run_step('calculate', (), kwargs, level, deadline)
+        finally:
+            self._exit(admitted_at)
+
+    def _run_step(self, method: str, args: tuple, kwargs: dict, level: int, deadline: float):
+        """
+        Шаг потокового расчета в пределах max_workers одновременных расчетов: для 'inline'
+        в текущем потоке, для пулов — задачей пула. Шаг должен начаться до deadline.
+        """
+        remaining = deadline - time.monotonic()
+        if self.backend == 'inline':
+            if remaining <= 0 or not self._running.acquire(timeout=remaining):
+                raise CalculationTimeout(f"Расчет не уложился в {self.task_timeout} с")
+            try:
+                return _execute(self.calculator, method, args, kwargs, level)
+            finally:
+                self._running.release()
+        future = self._submit(method, args, kwargs, level)
+        try:
+            return future.result(timeout=max(remaining, 0))
+        except FutureTimeoutError:
+            # Начавшийся шаг досчитывается, еще ждущий в очереди пула — отменяется
+            if future.cancel():
+                raise CalculationTimeout(f"Расчет не уложился в {self.task_timeout} с") from None
+            return future.result()
+
+    async def calculate_progressive_async(self, **kwargs):
+        """
+        То же для asyncio: каждый шаг считается в пуле потоков цикла событий. Если поток
+        закрыли посреди шага, шаг досчитывается, а следующие уже не начинаются.
+        """
+        loop = asyncio.get_running_loop()
+        steps = self.calculate_progressive(**kwargs)
+        pending = None
+        try:
+            while True:
+                pending = loop.run_in_executor(None, next, steps, None)
+                step = await asyncio.shield(pending)
+                if step is None:
+                    return
+                yield step
+        finally:
+            if pending is not None and not pending.done():
+                # Генератор еще занят в потоке пула: закрываем его, когда шаг закончится
+                pending.add_done_callback(lambda _: steps.close())
+            else:
+                steps.close()
+
+    def warm_up(self):
+        """Поднимает воркеры пула заранее, чтобы первый запрос не платил за их запуск."""
+        if self.backend == 'inline':
+            return
+        warm_up_task = dict(risk_profile='moderate', amount=100000, term_months=12)
+        futures = [self._submit('calculate', (), warm_up_task, 0) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+        print(f"[ПУЛ] Бэкенд '{self.backend}' прогрет: {self.max_workers} воркер(ов).")
+
+    def shutdown(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def in_flight(self) -> int:
+        """Принятые и еще не завершенные расчеты."""
+        return self._in_system
+
+    def _service_level(self) -> int:
+        """Уровень обслуживания (индекс в DEGRADATION_LEVELS) для задачи, принятой сейчас."""
+        if not self.degrade:
+            return 0
+        load = self._in_system / self.max_workers
+        return sum(load >= threshold for threshold in DEGRADATION_LOAD_FACTORS)
+
+    def _enter(self, level: int) -> float:
+        """Прием задачи на уровне level: время приема или CalculationRejected."""
+        with self._admission_lock:
+            if self._in_system >= self.queue_size:
+                # Примерно столько займет разбор уже принятых задач
+                retry_after = max(1, math.ceil(self._in_system / self.max_workers * self._average_seconds))
+                METRICS.inc('portfolio_admission_rejected_total')
+                raise CalculationRejected(retry_after=retry_after)
+            self._in_system += 1
+        METRICS.inc('portfolio_admissions_total', level=DEGRADATION_LEVELS[level][0])
+        return time.monotonic()
+
+    def _exit(self, admitted_at: float):
+        elapsed = time.monotonic() - admitted_at
+        with self._admission_lock:
+            self._in_system -= 1
+            self._average_seconds = elapsed if not self._average_seconds else 0.8 * self._average_seconds + 0.2 * elapsed
+
+    def _submit(self, method: str, args: tuple, kwargs: dict, level: int):
+        if self.backend == 'process':
+            return self._get_pool().submit(_calculate_in_worker, method, args, kwargs, level)
+        return self._get_pool().submit(_execute, self.calculator, method, args, kwargs, level)
+
+    def _admit(self, method: str, args: tuple, kwargs: dict, level: int):
+        """Принимает задачу и отправляет ее в пул."""
+        admitted_at = self._enter(level)
+        try:
+            future = self._submit(method, args, kwargs, level)
+        except Exception:
+            self._exit(admitted_at)
+            raise
+        # Место освобождается, когда задача действительно завершилась (даже после таймаута ожидания)
+        future.add_done_callback(lambda _: self._exit(admitted_at))
+        return future
+
+    def _admit_inline(self, method: str, args: tuple, kwargs: dict, level: int, tasks: list) -> Future:
+        """
+        Прием задачи для 'inline': возвращает future, а сам расчет добавляет в tasks —
+        его выполняет поток, который запустил расчет.
+        """
+        admitted_at = self._enter(level)
+        future = Future()
+
+        def task():
+            try:
+                if not self._running.acquire(timeout=self.task_timeout):
+                    future.set_exception(CalculationTimeout(f"Расчет не начался за {self.task_timeout} с"))
+                    return
+                try:
+                    self._compute_into(future, method, args, kwargs, level)
+                finally:
+                    self._running.release()
+            finally:
+                self._exit(admitted_at)
+
+        tasks.append(task)
+        return future
+
+    def _flight_key(self, method: str, args: tuple, kwargs: dict, level: int):
+        """
+        Ключ для объединения одинаковых расчетов уровня level; None — расчет идет сам по себе.
+        Ключ строится по аргументам после деградации и включает уровень: его имя попадает в ответ.
+        """
+        if method != 'calculate' or args or kwargs.get('random_shocks') is not None:
+            return None
+        level_name, engine = DEGRADATION_LEVELS[level]
+        try:
+            key = (level_name, self.calculator.request_key(**(kwargs if engine is None else _degrade(kwargs, engine))))
+            hash(key)
+        except (TypeError, ValueError):
+            # Некорректный запрос: пусть ошибку выдаст сам расчет
+            return None
+        return key
+
+    def _join_flight(self, key, start) -> Future:
+        """Future уже идущего расчета с тем же ключом или нового, запущенного start()."""
+        if key is None:
+            return start()
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight[1] += 1
+                METRICS.inc('portfolio_coalesced_requests_total')
+                return flight[0]
+            future = start()
+            self._flights[key] = [future, 1]
+        future.add_done_callback(lambda done: self._end_flight(key, done))
+        return future
+
+    def _end_flight(self, key, future):
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight[0] is future:
+                del self._flights[key]
+
+    def _leave_flight(self, key, future, cancel: bool):
+        """Ожидающий ушел; задача отменяется (cancel) только если ее больше никто не ждет."""
+        if key is not None:
+            with self._flights_lock:
+                flight = self._flights.get(key)
+                if flight is not None and flight[0] is future:
+                    flight[1] -= 1
+                    if flight[1] > 0:
+                        return
+        if cancel:
+            future.cancel()
+
+    def _compute_into(self, future: Future, method: str, args: tuple, kwargs: dict, level: int):
+        """Считает в текущем потоке и кладет результат (или исключение) в future."""
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = _execute(self.calculator, method, args, kwargs, level)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _run(self, method: str, args: tuple, kwargs: dict):
+        level = self._service_level()
+        key = self._flight_key(method, args, kwargs, level)
+        if self.backend == 'inline':
+            tasks = []
+            future = self._join_flight(key, lambda: self._admit_inline(method, args, kwargs, level, tasks))
+            for task in tasks:
+                # Этот запрос запустил расчет — он и считает
+                task()
+            try:
+                return future.result()
+            finally:
+                self._leave_flight(key, future, cancel=False)
+
+        future = self._join_flight(key, lambda: self._admit(method, args, kwargs, level))
+        timed_out = False
+        try:
+            return future.result(timeout=self.task_timeout)
+        except FutureTimeoutError:
+            timed_out = True
+            raise CalculationTimeout(f"Расчет не уложился в {self.task_timeout} с")
+        finally:
+            self._leave_flight(key, future, cancel=timed_out)
+
+    async def _run_async(self, method: str, args: tuple, kwargs: dict):
+        level = self._service_level()
+        key = self._flight_key(method, args, kwargs, level)
+        if self.backend == 'inline':
+            # 'inline' в asyncio-сервере: расчет уходит в пул цикла событий, чтобы не блокировать его
+            tasks = []
+            future = self._join_flight(key, lambda: self._admit_inline(method, args, kwargs, level, tasks))
+            for task in tasks:
+                asyncio.get_running_loop().run_in_executor(None, task)
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future))
+            finally:
+                self._leave_flight(key, future, cancel=False)
+
+        future = self._join_flight(key, lambda: self._admit(method, args, kwargs, level))
+        # Отмена ожидания одного клиента не должна отменять расчет, который ждут другие
+        waiter = asyncio.wrap_future(future) if key is None else asyncio.shield(asyncio.wrap_future(future))
+        timed_out = False
+        try:
+            return await asyncio.wait_for(waiter, self.task_timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            raise CalculationTimeout(f"Расчет не уложился в {self.task_timeout} с")
+        finally:
+            self._leave_flight(key, future, cancel=timed_out)
@@ -0,0 +1,94 @@
+# portfolio_bot/domain/forecast_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 2048
+DEFAULT_TTL_SECONDS = 15 * 60
+
+
+class ForecastCache:
+    """
+    LRU-кэш результатов PortfolioCalculator.calculate с ограниченным размером и TTL.
+
+    Ключ — нормализованные входные данные расчета вместе с версией каталога фондов.
+    Значения отдаются как есть (без копирования), поэтому результаты из кэша
+    нужно считать неизменяемыми. Все операции потокобезопасны.
+
+    Если заданы max_bytes и sizeof (значение -> размер в байтах), кэш ограничен
+    еще и суммарным размером: старые записи вытесняются, пока сумма больше
+    max_bytes (последняя добавленная запись остается в любом случае).
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_bytes: int = None, sizeof=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes if sizeof is not None else None
+        self._sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (время записи, результат)
+        self._sizes = {}  # key -> размер в байтах (только при ограничении по размеру)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Возвращает сохраненный результат или None, если записи нет или она устарела."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key) -> bool:
+        """Есть ли свежая запись; в отличие от get() не влияет на счетчики и порядок LRU."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), value)
+            if self.max_bytes is not None:
+                self._sizes[key] = self._sizeof(value)
+                self._bytes += self._sizes[key]
+            while len(self._entries) > self.max_size or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        """Удаляет запись; вызывается под self._lock."""
+        del self._entries[key]
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Счетчики попаданий/промахов и текущий размер кэша."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,202 @@
+# portfolio_bot/domain/forecast_grid.py
+# Предрасчитанная сетка прогнозов для стандартных стратегий.
+#
+# Сетка — результат сборки, а не исходник (portfolio_bot/data/ в .gitignore). Ее собирает
+# шаг деплоя (~8 с), до перезапуска API:
+#     python -m portfolio_bot.domain.forecast_grid
+# Серверы только открывают ее: если сетки нет или она собрана для другой версии каталога,
+# расчеты идут через симуляцию. Сборка пишет файлы во временную папку и подменяет их под
+# эксклюзивной блокировкой <папка>.lock, а load() читает под разделяемой, поэтому процесс,
+# стартующий во время сборки, видит либо старую сетку целиком, либо новую.
+# Файлы открываются через np.load(mmap_mode='r'), поэтому все процессы-воркеры делят одну
+# копию данных только для чтения через page cache.
+import contextlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # не POSIX: сборка и чтение без блокировки
+    fcntl = None
+
+from .calculator import NUM_SIMULATIONS, SAMPLING_METHOD
+
+GRID_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'forecast_grid')
+GRID_MAX_MONTHS = 360
+# Узлы по доле пополнений в капитале (см. ForecastGrid); между узлами — линейная интерполяция
+GRID_CONTRIBUTION_SHARES = 81
+GRID_FILES = ('bands.npy', 'means.npy', 'meta.json')
+
+
+class ForecastGrid:
+    """
+    Нормированные полосы прогноза для каждой стратегии из STRATEGY_TEMPLATES.
+
+    Для фиксированных шоков капитал равен amount*A_t + c*B_t. С масштабом s_t = E[B_t] / E[A_t]
+    это (amount + c*s_t) * ((1-x_t)*A_t + x_t*B_t/s_t), где x_t = c*s_t / (amount + c*s_t) —
+    доля пополнений в ожидаемом капитале. Поэтому достаточно хранить перцентили смеси для сетки x
+    и средние A_t, B_t; нормировка на s_t делает перцентили почти линейными по x.
+    Пути строятся на полный GRID_MAX_MONTHS, и прогноз на срок T — это первые T+1 точек:
+    при движении ползунка срока график не "перетасовывается".
+    """
+
+    def __init__(self, meta: dict, bands: np.ndarray, means: np.ndarray):
+        self.meta = meta
+        self.bands = bands  # (стратегии, узлы x, месяцы + 1, [min, max])
+        self.means = means  # (стратегии, месяцы + 1, [A, B])
+        self._profile_index = {profile: i for i, profile in enumerate(meta['profiles'])}
+
+    @classmethod
+    def load(cls, grid_dir: str = GRID_DIR, catalog_version: str = None):
+        """Открывает сетку через mmap. Возвращает None, если сетки нет или каталог изменился."""
+        with _grid_lock(grid_dir, exclusive=False):
+            return cls._load(grid_dir, catalog_version)
+
+    @classmethod
+    def _load(cls, grid_dir: str, catalog_version: str):
+        meta_path = os.path.join(grid_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            print(f"[СЕТКА] Предрасчитанная сетка не найдена в {grid_dir}, расчеты пойдут через симуляцию "
+                  f"(собрать: python -m portfolio_bot.domain.forecast_grid).")
+            return None
+
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if catalog_version and meta.get('catalog_version') != catalog_version:
+            print("[СЕТКА] Сетка собрана для другой версии каталога и не будет использоваться.")
+            return None
+        if meta.get('num_simulations') != NUM_SIMULATIONS or meta.get('sampling_method') != SAMPLING_METHOD:
+            print("[СЕТКА] Сетка собрана с другими параметрами симуляции и не будет использоваться.")
+            return None
+
+        bands = np.load(os.path.join(grid_dir, 'bands.npy'), mmap_mode='r')
+        means = np.load(os.path.join(grid_dir, 'means.npy'), mmap_mode='r')
+        print(f"[СЕТКА] Загружена сетка прогнозов: {len(meta['profiles'])} стратегий, до {meta['max_months']} мес.")
+        return cls(meta, bands, means)
+
+    def lookup(self, risk_profile: str, amount: float, monthly_contribution: float, num_months: int,
+               annual_return: float, annual_volatility: float):
+        """
+        Прогноз в формате _generate_forecast_monte_carlo или None, если запрос не покрыт сеткой
+        (другая стратегия, слишком длинный срок, измененный состав или нулевой капитал).
+        """
+        index = self._profile_index.get(risk_profile)
+        if index is None or num_months > self.meta['max_months']:
+            return None
+        # Доходность и волатильность сверяются, чтобы не отдать прогноз для другого состава
+        expected_return, expected_volatility = self.meta['metrics'][index]
+        if not (np.isclose(annual_return, expected_return) and np.isclose(annual_volatility, expected_volatility)):
+            return None
+
+        months = np.arange(num_months + 1)
+        means = self.means[index, :num_months + 1]
+        total = amount + monthly_contribution * _contribution_scale(means)
+        if not (total > 0).all():
+            return None
+
+        num_shares = self.bands.shape[1]
+        position = monthly_contribution * _contribution_scale(means) / total * (num_shares - 1)
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower + 1, num_shares - 1)
+        weight = (position - lower)[:, None]
+        profile_bands = self.bands[index]
+        bands = total[:, None] * ((1 - weight) * profile_bands[lower, months] + weight * profile_bands[upper, months])
+
+        bands = np.ascontiguousarray(bands.T)
+        return {
+            "labels": list(range(num_months + 1)),
+            "avg": amount * means[:, 0] + monthly_contribution * means[:, 1],
+            "min": bands[0],
+            "max": bands[1]
+        }
+
+
+@contextlib.contextmanager
+def _grid_lock(grid_dir: str, exclusive: bool):
+    """Блокировка сетки: эксклюзивная — на подмену файлов, разделяемая — на чтение."""
+    if fcntl is None:
+        yield
+        return
+    lock_path = f"{os.path.normpath(grid_dir)}.lock"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _contribution_scale(means: np.ndarray) -> np.ndarray:
+    """s_t = E[B_t] / E[A_t]; в первые месяцы, когда пополнений еще нет, s_t = 1."""
+    scale = np.ones(len(means))
+    has_contributions = (means[:, 0] > 0) & (means[:, 1] > 0)
+    scale[has_contributions] = means[has_contributions, 1] / means[has_contributions, 0]
+    return scale
+
+
+def build_forecast_grid(calculator, grid_dir: str = GRID_DIR, max_months: int = GRID_MAX_MONTHS,
+                        num_shares: int = GRID_CONTRIBUTION_SHARES):
+    """Считает сетку для всех стратегий репозитория калькулятора и записывает ее в grid_dir."""
+    repository = calculator.repository
+    catalog = repository.get_catalog()
+    shares = np.linspace(0, 1, num_shares)
+    profiles, metrics, bands, means = [], [], [], []
+
+    for risk_profile in repository.get_strategy_profiles():
+        annual_return, annual_volatility = catalog.template_metrics[risk_profile]
+        monthly_return, monthly_volatility = calculator._monthly_parameters(annual_return, annual_volatility)
+        basis = calculator._get_basis_paths(max_months, monthly_return, monthly_volatility, ('grid', risk_profile, max_months))
+
+        percentiles = list(calculator._get_percentile_bounds(risk_profile))
+        profile_means = np.stack([basis["amount_mean"], basis["contribution_mean"]], axis=1)
+        normalized_contribution = basis["contribution"] / _contribution_scale(profile_means)[:, None]
+        bands.append(np.stack([
+            calculator._select_percentiles((1 - share) * basis["amount"] + share * normalized_contribution, percentiles)
+            for share in shares
+        ]))
+        means.append(profile_means)
+        profiles.append(risk_profile)
+        metrics.append([annual_return, annual_volatility])
+        print(f"[СЕТКА] Готова стратегия '{risk_profile}'.")
+
+    # Файлы пишутся во временную папку и подменяются через os.replace: процесс, который
+    # сейчас читает старую сетку через mmap, продолжает видеть ее целиком
+    grid_dir = os.path.normpath(grid_dir)
+    os.makedirs(os.path.dirname(grid_dir), exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix=f"{os.path.basename(grid_dir)}.tmp-", dir=os.path.dirname(grid_dir))
+    np.save(os.path.join(build_dir, 'bands.npy'), np.stack(bands))
+    np.save(os.path.join(build_dir, 'means.npy'), np.stack(means))
+    meta = {
+        "profiles": profiles,
+        "metrics": metrics,
+        "max_months": max_months,
+        "num_simulations": calculator.num_simulations,
+        "sampling_method": calculator.sampling_method,
+        "catalog_version": repository.get_catalog_version()
+    }
+    with open(os.path.join(build_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    # Подмена под эксклюзивной блокировкой: load() не увидит смесь старых и новых файлов,
+    # а одновременные сборки подменяют файлы по очереди. meta.json, кроме того, убирается
+    # первым и появляется последним: по нему load() понимает, что сетка собрана целиком
+    with _grid_lock(grid_dir, exclusive=True):
+        os.makedirs(grid_dir, exist_ok=True)
+        meta_path = os.path.join(grid_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for file_name in GRID_FILES:
+            os.replace(os.path.join(build_dir, file_name), os.path.join(grid_dir, file_name))
+    os.rmdir(build_dir)
+    print(f"[СЕТКА] Сетка сохранена в {os.path.abspath(grid_dir)}")
+
+
+if __name__ == '__main__':
+    from portfolio_bot.database.repository import CombinedRepository
+    from portfolio_bot.domain.calculator import PortfolioCalculator
+
+    build_forecast_grid(PortfolioCalculator(CombinedRepository()))
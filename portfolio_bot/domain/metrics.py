@@ -0,0 +1,175 @@
+# portfolio_bot/domain/metrics.py
+# Метрики сервиса в памяти процесса и их выдача в текстовом формате Prometheus.
+#
+# Этапы расчета замеряются через stage()/timed_stage(). Время этапа — собственное:
+# время вложенных этапов (например, 'percentiles' внутри 'forecast') вычитается из
+# внешнего, поэтому этапы не пересекаются и в сумме не превышают время запроса.
+# Внутри request_timings() длительности одного этапа за запрос суммируются (например,
+# все блоки потокового режима) и попадают в гистограмму одним наблюдением на запрос.
+# С бэкендом 'process' этапы расчета замеряются в процессах-воркерах и в /api/metrics
+# родительского процесса не видны; счетчики и задержки HTTP-запросов видны всегда.
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм задержек, в секундах
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Подробный лог каждого расчета (print в горячем пути) — только для отладки
+DEBUG_LOG = os.environ.get('PORTFOLIO_DEBUG_LOG') == '1'
+
+
+def debug_log(message: str):
+    """Печатает сообщение только при PORTFOLIO_DEBUG_LOG=1."""
+    if DEBUG_LOG:
+        print(message)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class _Histogram:
+    """Кумулятивные корзины, сумма и число наблюдений одного набора меток."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Потокобезопасный реестр счетчиков и гистограмм.
+    Метрика — имя плюс набор меток: inc('requests_total', endpoint='calculate').
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}    # (имя, метки) -> значение
+        self._histograms = {}  # (имя, метки) -> _Histogram
+        self._help = {}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def render(self, extra_gauges: dict = None, extra_counters: dict = None) -> str:
+        """
+        Все метрики в текстовом формате Prometheus (версия 0.0.4). extra_gauges/extra_counters —
+        значения, которые ведутся вне реестра (например, счетчики ForecastCache).
+        """
+        lines = []
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [(key, list(h.counts), h.total, h.count) for key, h in histograms]
+
+        counters = sorted(counters + [((name, ()), value) for name, value in (extra_counters or {}).items()])
+        described = set()
+
+        def header(name, metric_type):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), counts, total, count in histograms:
+            header(name, 'histogram')
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for name, value in sorted((extra_gauges or {}).items()):
+            header(name, 'gauge')
+            lines.append(f"{name} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+METRICS.describe('portfolio_stage_duration_seconds', 'Длительность этапа расчета за запрос')
+
+_request_state = threading.local()
+
+
+@contextmanager
+def request_timings():
+    """Собирает длительности этапов одного расчета и сбрасывает их в METRICS на выходе."""
+    if getattr(_request_state, 'timings', None) is not None:
+        # Вложенный вызов учитывается во внешнем
+        yield
+        return
+    _request_state.timings = timings = {}
+    try:
+        yield
+    finally:
+        _request_state.timings = None
+        for stage_name, elapsed in timings.items():
+            METRICS.observe('portfolio_stage_duration_seconds', elapsed, stage=stage_name)
+
+
+@contextmanager
+def stage(name: str):
+    """Замеряет собственное время этапа расчета, без вложенных этапов (см. request_timings)."""
+    stack = getattr(_request_state, 'stages', None)
+    if stack is None:
+        stack = _request_state.stages = []
+    # [время вложенных этапов]; вложенный этап на выходе добавляет сюда свое полное время
+    frame = [0.0]
+    stack.append(frame)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        total = time.perf_counter() - started
+        stack.pop()
+        if stack:
+            stack[-1][0] += total
+        elapsed = total - frame[0]
+        timings = getattr(_request_state, 'timings', None)
+        if timings is None:
+            METRICS.observe('portfolio_stage_duration_seconds', elapsed, stage=name)
+        else:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed_stage(name: str):
+    """Декоратор: весь вызов метода замеряется как этап name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,63 @@
+# portfolio_bot/gunicorn_conf.py
+# Конфигурация pre-fork сервера API (gunicorn). Запуск и перезагрузка — через portfolio_bot/serve.py.
+#
+# Приложение загружается один раз в мастер-процессе (preload_app): SQLite-миграция,
+# снимок каталога фондов, mmap сетки прогнозов и калькулятор создаются до fork,
+# и N воркеров делят эту память copy-on-write. Воркер стартует за миллисекунды:
+# ему остается только поднять свой пул расчетов.
+#
+# Переменные окружения:
+#   API_SERVER   — 'wsgi' (Flask, api_server.py) или 'asgi' (asgi_server.py через uvicorn);
+#   API_WORKERS  — число воркеров (по умолчанию — число ядер);
+#   API_THREADS  — потоков на воркер для 'wsgi' (по умолчанию 8);
+#   API_BIND     — адрес (по умолчанию 127.0.0.1:5001);
+#   API_PIDFILE  — pid-файл мастера (нужен для serve.py reload/stop).
+#
+# Очередь расчетов (CalculationExecutor) у каждого воркера своя, и по умолчанию она
+# подстраивается под воркер: один расчет за раз (ядра заняты воркерами), а принятых
+# расчетов не больше половины потоков. Так деградация и отказ 429 с Retry-After
+# наступают раньше, чем у воркера кончатся потоки, а остальные потоки отвечают
+# на отказы, /health и статику. Явные CALCULATION_WORKERS / CALCULATION_QUEUE_SIZE важнее.
+import gc
+import importlib
+import multiprocessing
+import os
+
+APP_MODULES = {
+    'wsgi': 'portfolio_bot.api_server',
+    'asgi': 'portfolio_bot.asgi_server',
+}
+API_SERVER = os.environ.get('API_SERVER', 'wsgi')
+if API_SERVER not in APP_MODULES:
+    raise ValueError(f"Неизвестный API_SERVER: {API_SERVER}")
+
+# Приложение импортируется в мастере уже после чтения этого файла
+os.environ['API_PREFORK'] = '1'
+wsgi_app = f"{APP_MODULES[API_SERVER]}:app"
+bind = os.environ.get('API_BIND', '127.0.0.1:5001')
+workers = int(os.environ.get('API_WORKERS', 0)) or multiprocessing.cpu_count()
+worker_class = 'uvicorn.workers.UvicornWorker' if API_SERVER == 'asgi' else 'gthread'
+threads = int(os.environ.get('API_THREADS', 8))
+
+# Параллелизм дают процессы-воркеры: по умолчанию расчет идет в потоке запроса
+os.environ.setdefault('CALCULATION_BACKEND', 'inline')
+os.environ.setdefault('CALCULATION_WORKERS', '1')
+if API_SERVER == 'wsgi':
+    # Больше запросов, чем потоков, в воркер gthread не попадает: очередь должна быть меньше
+    os.environ.setdefault('CALCULATION_QUEUE_SIZE', str(max(1, threads // 2)))
+preload_app = True
+pidfile = os.environ.get('API_PIDFILE', '/tmp/portfolio_api.pid')
+# Столько ждем завершения текущих запросов при остановке и перезагрузке воркеров
+graceful_timeout = 30
+timeout = 60
+
+
+def when_ready(server):
+    # Все, что загружено до этого момента, GC больше не трогает: иначе обход объектов
+    # сборщиком мусора в воркерах копировал бы общие страницы памяти
+    gc.freeze()
+    server.log.info(f"[PRE-FORK] Приложение {wsgi_app} загружено в мастере, воркеров: {workers}")
+
+
+def post_fork(server, worker):
+    importlib.import_module(APP_MODULES[API_SERVER]).executor.warm_up()
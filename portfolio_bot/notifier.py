@@ -0,0 +1,184 @@
+# portfolio_bot/notifier.py
+# Доставка уведомлений боту (/send_portfolio в main.py) в фоне.
+#
+# /api/notify только проверяет запрос и кладет его в очередь, отвечая 202: пользователь
+# не ждет, пока бот синхронно отправит сообщение в Telegram. Потоки доставки берут задания
+# из очереди и отправляют их через общий requests.Session (keep-alive, пул соединений),
+# повторяя неудачные попытки с экспоненциальной паузой.
+#
+# Повтор не должен отправить пользователю второе сообщение. У каждого уведомления свой
+# ключ (заголовок Idempotency-Key), одинаковый во всех попытках: бот отправляет сообщение
+# по ключу не больше одного раза, а на повтор уже принятого отвечает 200. Повторяются
+# только сетевые ошибки и ответы 5xx, которые бот отдает до отправки; если отправка уже
+# начиналась и не удалась, бот отвечает 4xx, и уведомление больше не повторяется.
+#
+# Очередь ограничена (NOTIFY_QUEUE_SIZE). При переполнении (NOTIFY_OVERFLOW):
+#   'reject'      — новое уведомление отклоняется, клиент получает 503;
+#   'drop_oldest' — из очереди выбрасывается самое старое, новое принимается.
+# Глубина очереди, задержка доставки, повторы и потери видны в /api/metrics.
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from portfolio_bot import codec
+from portfolio_bot.domain.metrics import METRICS
+
+OVERFLOW_POLICIES = ('reject', 'drop_oldest')
+# Сколько ждать недоставленные уведомления при остановке процесса
+DRAIN_TIMEOUT_SECONDS = 5.0
+
+METRICS.describe('portfolio_notify_enqueued_total', 'Число уведомлений, принятых в очередь')
+METRICS.describe('portfolio_notify_delivered_total', 'Число уведомлений, доставленных боту')
+METRICS.describe('portfolio_notify_failed_total', 'Число уведомлений, не доставленных после всех попыток')
+METRICS.describe('portfolio_notify_dropped_total', 'Число уведомлений, потерянных из-за переполнения очереди')
+METRICS.describe('portfolio_notify_retries_total', 'Число повторных попыток доставки')
+METRICS.describe('portfolio_notify_delivery_seconds', 'Время от постановки в очередь до доставки боту')
+
+
+class NotificationRejected(Exception):
+    """Очередь уведомлений переполнена (политика 'reject')."""
+
+
+class BotNotifier:
+    """
+    Очередь уведомлений боту с фоновыми потоками доставки.
+    Потоки запускаются при первом уведомлении в процессе: под pre-fork сервером
+    у каждого воркера своя очередь и свои потоки (потоки не переживают fork).
+    """
+
+    def __init__(self, url: str, queue_size: int = 1000, workers: int = 2, max_attempts: int = 3,
+                 timeout: float = 10.0, backoff: float = 0.5, overflow: str = 'reject'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {overflow}")
+        self.url = url
+        self.queue_size = queue_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.backoff = backoff
+        self.overflow = overflow
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._session = None
+        self._threads = []
+
+    @classmethod
+    def from_env(cls, url: str) -> 'BotNotifier':
+        return cls(
+            url,
+            queue_size=int(os.environ.get('NOTIFY_QUEUE_SIZE', 1000)),
+            workers=int(os.environ.get('NOTIFY_WORKERS', 2)),
+            max_attempts=int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 3)),
+            timeout=float(os.environ.get('NOTIFY_TIMEOUT', 10)),
+            overflow=os.environ.get('NOTIFY_OVERFLOW', 'reject')
+        )
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._session = requests.Session()
+            self._session.headers['Content-Type'] = 'application/json'
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+            self._threads = [
+                threading.Thread(target=self._deliver_loop, name=f'bot-notifier-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+        # При обычном завершении процесса (в т.ч. воркера gunicorn) очередь дочищается
+        atexit.register(self.close)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def enqueue(self, payload: dict):
+        """Ставит уведомление в очередь; NotificationRejected, если места нет."""
+        self._start()
+        job = (time.monotonic(), payload, uuid.uuid4().hex)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            if self.overflow == 'reject':
+                METRICS.inc('portfolio_notify_dropped_total', reason='rejected')
+                raise NotificationRejected()
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                METRICS.inc('portfolio_notify_dropped_total', reason='drop_oldest')
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                # Освободившееся место успел занять другой поток
+                METRICS.inc('portfolio_notify_dropped_total', reason='rejected')
+                raise NotificationRejected()
+        METRICS.inc('portfolio_notify_enqueued_total')
+
+    def _deliver_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._deliver(*job)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, enqueued_at: float, payload: dict, idempotency_key: str):
+        body = codec.dumps(payload)
+        headers = {'Idempotency-Key': idempotency_key}
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            if attempt > 1:
+                METRICS.inc('portfolio_notify_retries_total')
+                # Экспоненциальная пауза со случайной добавкой, чтобы повторы не шли пачкой
+                time.sleep(self.backoff * 2 ** (attempt - 2) * (1 + random.random()))
+            try:
+                response = self._session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = e
+                continue
+            if response.status_code == 200:
+                METRICS.inc('portfolio_notify_delivered_total')
+                METRICS.observe('portfolio_notify_delivery_seconds', time.monotonic() - enqueued_at)
+                return
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+            if response.status_code < 500:
+                # Бот отверг уведомление или уже пытался его отправить: повтор ничего не изменит
+                # или пришлет пользователю дубль
+                break
+        METRICS.inc('portfolio_notify_failed_total')
+        print(f"⚠️ [УВЕДОМЛЕНИЯ] Не удалось доставить уведомление боту: {error}")
+
+    def close(self, timeout: float = DRAIN_TIMEOUT_SECONDS):
+        """Ждет доставки оставшихся уведомлений (не дольше timeout) и останавливает потоки."""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self._queue.unfinished_tasks:
+            print(f"⚠️ [УВЕДОМЛЕНИЯ] При остановке не доставлено: {self._queue.qsize()}")
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        self._session.close()
+        self._pid = None
@@ -0,0 +1,104 @@
+# portfolio_bot/serve.py
+# Управление pre-fork сервером API (конфигурация — gunicorn_conf.py).
+#
+#     python -m portfolio_bot.serve start    # мастер + воркеры, приложение загружено до fork
+#     python -m portfolio_bot.serve reload   # новый код и каталог без потери запросов
+#     python -m portfolio_bot.serve stop
+#
+# Сигналы мастеру gunicorn:
+#   HUP  — перечитать конфигурацию и перезапустить воркеров. Под preload_app воркеры
+#          форкаются от старого мастера, поэтому новый код и новая версия каталога
+#          так НЕ подхватываются (подходит для смены API_WORKERS и т.п.).
+#   USR2 — запустить новый мастер (заново загружает приложение) рядом со старым;
+#          оба слушают один сокет. reload ждет готовности новых воркеров и только
+#          потом посылает старому мастеру TERM: тот дообслуживает начатые запросы.
+import argparse
+import os
+import signal
+import sys
+import time
+
+from portfolio_bot import gunicorn_conf
+
+RELOAD_TIMEOUT_SECONDS = 60
+
+
+def _read_pid(pidfile: str):
+    try:
+        with open(pidfile) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _worker_count(master_pid: int) -> int:
+    """Число дочерних процессов мастера (Linux, /proc)."""
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+            return len(f.read().split())
+    except OSError:
+        return 0
+
+
+def start():
+    command = ['gunicorn', '-c', 'python:portfolio_bot.gunicorn_conf']
+    print(f"[PRE-FORK] Запуск: {' '.join(command)} ({gunicorn_conf.wsgi_app}, воркеров: {gunicorn_conf.workers})")
+    os.execvp(command[0], command)
+
+
+def reload() -> int:
+    pidfile = gunicorn_conf.pidfile
+    old_pid = _read_pid(pidfile)
+    if old_pid is None or not _is_alive(old_pid):
+        print(f"❌ Сервер не запущен (pid-файл {pidfile})")
+        return 1
+
+    os.kill(old_pid, signal.SIGUSR2)
+    print(f"[PRE-FORK] Старый мастер {old_pid}: запущен новый мастер, жду его воркеров...")
+    deadline = time.monotonic() + RELOAD_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        # До TERM старому мастеру новый пишет свой pid в "<pidfile>.2"
+        new_pid = _read_pid(pidfile + '.2')
+        if new_pid and _worker_count(new_pid) >= gunicorn_conf.workers:
+            os.kill(old_pid, signal.SIGTERM)
+            print(f"✅ Перезагрузка завершена: новый мастер {new_pid}, старый {old_pid} останавливается")
+            return 0
+        time.sleep(0.2)
+
+    # Новый мастер не поднялся (например, ошибка в коде): старый продолжает работать
+    print(f"❌ Новый мастер не запустился за {RELOAD_TIMEOUT_SECONDS} с, старый мастер {old_pid} оставлен")
+    return 1
+
+
+def stop() -> int:
+    pid = _read_pid(gunicorn_conf.pidfile)
+    if pid is None or not _is_alive(pid):
+        print("Сервер не запущен")
+        return 0
+    os.kill(pid, signal.SIGTERM)
+    print(f"[PRE-FORK] Мастер {pid} останавливается (graceful_timeout {gunicorn_conf.graceful_timeout} с)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork сервер API (gunicorn)")
+    parser.add_argument('command', choices=('start', 'reload', 'stop'))
+    args = parser.parse_args()
+
+    if args.command == 'start':
+        start()
+    sys.exit(reload() if args.command == 'reload' else stop())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+# portfolio_bot/static_assets.py
+# Статика мини-приложения из памяти: файлы portfolio_mini_app читаются один раз при старте,
+# текстовые заранее сжимаются (gzip и, если установлен brotli, br), у каждого файла есть
+# сильный ETag. Повторный заход из Telegram обходится ответом 304 без тела.
+#
+# Ссылки на css/js/картинки в HTML-страницах переписываются на адреса с хэшем содержимого
+# (css/styles.css -> css/styles.<хэш>.css): такие ответы кэшируются клиентом навсегда
+# (immutable), а при изменении файла меняется и адрес. Сами страницы и файлы по обычным
+# адресам отдаются с no-cache, то есть каждый раз перепроверяются по ETag.
+#
+# Изменения на диске подхватываются без перезапуска: фоновый поток раз в STATIC_RELOAD_INTERVAL
+# секунд сверяет размеры и время изменения файлов (0 — не проверять) и при изменениях
+# пересобирает кэш. Запросы ни файлов, ни сжатия не ждут: до конца пересборки отдается
+# прежний снимок (важно для ASGI-сервера, где respond() вызывается в цикле событий).
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # без brotli текстовые файлы сжимаются только gzip
+    brotli = None
+
+RELOAD_INTERVAL_SECONDS = float(os.environ.get('STATIC_RELOAD_INTERVAL', 2))
+# Длина хэша содержимого в адресах файлов
+URL_HASH_LENGTH = 10
+# Файлы меньше этого размера не сжимаются: выигрыш меньше заголовков
+MIN_COMPRESS_BYTES = 512
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# Порядок предпочтения сжатия, если клиент принимает несколько
+ENCODING_PREFERENCE = ('br', 'gzip')
+_ETAG_SUFFIXES = {'identity': '', 'gzip': '-gz', 'br': '-br'}
+# src="..." и href="..." в HTML-страницах
+_HTML_LINK_RE = re.compile(r'\b(src|href)="([^"?#:]+)"')
+
+
+def _content_type(relative_path: str) -> str:
+    if relative_path.endswith('.js'):
+        content_type = 'application/javascript'
+    else:
+        content_type = mimetypes.guess_type(relative_path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json', 'image/svg+xml'):
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    """Кодировки из заголовка Accept-Encoding, кроме явно запрещенных (q=0)."""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if name and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.lower())
+    return accepted
+
+
+class StaticAsset:
+    """
+    Содержимое одного файла (или готового JSON-ответа): исходное и заранее
+    сжатые варианты с ETag каждого.
+    """
+
+    def __init__(self, body: bytes, content_type: str):
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.variants = {'identity': body}
+
+        compressible = content_type.split(';')[0] in ('application/javascript', 'application/json', 'image/svg+xml') \
+            or content_type.startswith('text/')
+        if compressible and len(body) >= MIN_COMPRESS_BYTES:
+            compressed = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(body, quality=11)
+            self.variants.update({encoding: data for encoding, data in compressed.items() if len(data) < len(body)})
+
+    def select(self, accept_encoding: str) -> str:
+        if len(self.variants) == 1:
+            return 'identity'
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ENCODING_PREFERENCE:
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding
+        return 'identity'
+
+    def etag(self, encoding: str) -> str:
+        # Сильный ETag обязан различаться у разных представлений одного файла
+        return f'"{self.digest[:32]}{_ETAG_SUFFIXES[encoding]}"'
+
+    def respond(self, cache_control: str, if_none_match: str = None, accept_encoding: str = None) -> tuple:
+        """(статус, [(заголовок, значение)], тело): 304, если у клиента уже есть это представление."""
+        encoding = self.select(accept_encoding)
+        etag = self.etag(encoding)
+        headers = [('ETag', etag), ('Cache-Control', cache_control)]
+        if len(self.variants) > 1:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if if_none_match:
+            client_tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            if etag in client_tags or '*' in client_tags:
+                return 304, headers, b''
+
+        headers.append(('Content-Type', self.content_type))
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        return 200, headers, self.variants[encoding]
+
+
+class StaticAssetCache:
+    """
+    Папка с фронтендом в памяти. respond() возвращает (статус, заголовки, тело)
+    и одинаково используется Flask- и ASGI-серверами.
+    """
+
+    def __init__(self, root: str, reload_interval: float = RELOAD_INTERVAL_SECONDS):
+        self.root = root
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._watcher_pid = None
+        # Снимок (подпись файлов, маршруты) заменяется целиком, одним присваиванием
+        self._snapshot = (None, {})
+        self._reload()
+
+    @property
+    def available(self) -> bool:
+        return self._snapshot[0] is not None
+
+    def _scan(self):
+        """(путь, размер, время изменения) всех файлов; None, если папки нет."""
+        if not os.path.isdir(self.root):
+            return None
+        signature = []
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                file_path = os.path.join(directory, file_name)
+                stat = os.stat(file_path)
+                relative_path = os.path.relpath(file_path, self.root).replace(os.sep, '/')
+                signature.append((relative_path, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(signature))
+
+    def _reload(self):
+        signature = self._scan()
+        if signature == self._snapshot[0] and self._snapshot[1]:
+            return
+        if signature is None:
+            self._snapshot = (None, {})
+            return
+
+        files = {}
+        for relative_path, _, _ in signature:
+            with open(os.path.join(self.root, relative_path), 'rb') as f:
+                files[relative_path] = f.read()
+
+        # Адреса с хэшем — для всего, кроме страниц: на страницы ведут обычные ссылки и переходы из JS
+        hashed_urls = {}
+        for relative_path, body in files.items():
+            if relative_path.endswith('.html'):
+                continue
+            stem, extension = os.path.splitext(relative_path)
+            hashed_urls[relative_path] = f"{stem}.{hashlib.sha256(body).hexdigest()[:URL_HASH_LENGTH]}{extension}"
+
+        routes = {}
+        for relative_path, body in files.items():
+            if relative_path.endswith('.html'):
+                body = self._link_hashed_urls(relative_path, body, hashed_urls)
+            asset = StaticAsset(body, _content_type(relative_path))
+            routes[relative_path] = (asset, REVALIDATE_CACHE_CONTROL)
+            if relative_path in hashed_urls:
+                routes[hashed_urls[relative_path]] = (asset, IMMUTABLE_CACHE_CONTROL)
+        self._snapshot = (signature, routes)
+
+        total_bytes = sum(len(body) for body in files.values())
+        print(f"[СТАТИКА] Загружено {len(files)} файлов ({total_bytes / 1024:.0f} КБ), сжатие: "
+              f"{'br, gzip' if brotli is not None else 'gzip'}")
+
+    @staticmethod
+    def _link_hashed_urls(page_path: str, body: bytes, hashed_urls: dict) -> bytes:
+        page_directory = os.path.dirname(page_path)
+
+        def replace(match):
+            target = os.path.normpath(os.path.join(page_directory, match.group(2))).replace(os.sep, '/')
+            if target not in hashed_urls:
+                return match.group(0)
+            return f'{match.group(1)}="{os.path.relpath(hashed_urls[target], page_directory or ".")}"'
+
+        return _HTML_LINK_RE.sub(replace, body.decode('utf-8')).encode('utf-8')
+
+    def _ensure_watcher(self):
+        """Фоновая проверка изменений; поток запускается в каждом процессе (потоки не переживают fork)."""
+        if self.reload_interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            threading.Thread(target=self._watch, name='static-assets-reload', daemon=True).start()
+            self._watcher_pid = os.getpid()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                self._reload()
+            except OSError as e:
+                # Файл удален или перезаписывается прямо сейчас: попробуем при следующей проверке
+                print(f"⚠️ [СТАТИКА] Не удалось перечитать {self.root}: {e}")
+
+    def respond(self, path: str, if_none_match: str = None, accept_encoding: str = None) -> tuple:
+        """(статус, [(заголовок, значение)], тело) для GET/HEAD-запроса к статике."""
+        self._ensure_watcher()
+        signature, routes = self._snapshot
+        if signature is None:
+            return 500, [('Content-Type', 'text/html; charset=utf-8')], \
+                "Ошибка: Директория со статическими файлами не найдена.".encode()
+
+        relative_path = path.lstrip('/') or 'index.html'
+        route = routes.get(relative_path)
+        if route is None:
+            return 404, [('Content-Type', 'text/html; charset=utf-8')], f"Файл не найден: {relative_path}".encode()
+
+        asset, cache_control = route
+        return asset.respond(cache_control, if_none_match, accept_encoding)
@@ -29,7 +29,10 @@ const state = {
 };
 let chartInstance = null;
 let backendDataCache = null;
+let calculationController = null; // AbortController текущего запроса расчета
 const API_URL = `${window.location.origin}/api/calculate`;
+const BATCH_API_URL = `${window.location.origin}/api/calculate/batch`;
+const STREAM_API_URL = `${window.location.origin}/api/calculate/stream`;
 const PASSIVE_INCOME_RATE = 0.18; 
 const RECALCULATION_DELAY = 500; // 50ms задержка
 
@@ -492,53 +495,101 @@ function updateChartLegend(chart, investmentData, currentChartView) {
     legendContainer.innerHTML = legendHTML;
 }
 
+// Потоковый расчет (NDJSON): грубая оценка приходит почти сразу, затем уточнения и полный результат.
+// onStep вызывается на каждом шаге; возвращается полный результат.
+async function fetchProgressive(payload, onStep, signal) {
+    const response = await fetch(STREAM_API_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload),
+        signal
+    });
+    if (!response.ok) throw new Error('Ошибка сети при основном запросе');
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline);
+            buffer = buffer.slice(newline + 1);
+            if (!line) continue;
+            const message = JSON.parse(line);
+            if (message.event === 'error') throw new Error(message.error);
+            result = message.result;
+            onStep(message);
+        }
+    }
+    return result;
+}
+
 async function makeApiCallAndUpdateChart() {
     const currentStepId = state.history[state.history.length - 1];
     const isApiStep = ['step-grow-term', 'step-dream-term', 'step-passive-term', 'step-risk', 'step-contribution'].includes(currentStepId);
     
+    // Расчет для прежнего положения слайдера больше не нужен: соединение закрывается,
+    // и сервер не досчитывает его симуляции
+    if (calculationController) calculationController.abort();
+
     if (!isApiStep) {
+        // Новый запрос не начинается: прерванный не вернет графику прозрачность сам
+        calculationController = null;
+        if (chartInstance) chartInstance.canvas.style.opacity = '1';
         backendDataCache = null;
         updateChart();
         return;
     }
+    const controller = calculationController = new AbortController();
 
     try {
         chartInstance.canvas.style.opacity = '0.5';
         
-        const response = await fetch(API_URL, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(state.investmentData)
-        });
-        if (!response.ok) throw new Error('Ошибка сети при основном запросе');
-        
-        backendDataCache = await response.json();
-
         if (currentStepId === 'step-contribution' && state.investmentData.monthlyContribution > 0) {
+            // Прогнозы с пополнениями и без считаются одним пакетным запросом
+            // на общих случайных шоках, поэтому их сравнение не искажено шумом.
             const payloadWithoutContributions = {
                 ...state.investmentData,
                 monthlyContribution: 0
             };
-            const responseWithout = await fetch(API_URL, {
+            const response = await fetch(BATCH_API_URL, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payloadWithoutContributions)
+                body: JSON.stringify({ scenarios: [state.investmentData, payloadWithoutContributions] }),
+                signal: controller.signal
             });
+            if (!response.ok) throw new Error('Ошибка сети при пакетном запросе');
+
+            const { results } = await response.json();
+            backendDataCache = results[0];
 
-            if (responseWithout.ok) {
-                const dataWithout = await responseWithout.json();
-                backendDataCache.forecast_without_contribution = dataWithout.forecast;
+            if (results[1] && !results[1].error) {
+                backendDataCache.forecast_without_contribution = results[1].forecast;
             } else {
                  console.warn("Не удалось загрузить прогноз без пополнений для сравнения.");
             }
+            drawForecast(backendDataCache);
+        } else {
+            // Грубая оценка рисуется сразу, график остается приглушенным до полного результата
+            await fetchProgressive(state.investmentData, (message) => {
+                backendDataCache = message.result;
+                drawForecast(backendDataCache);
+                chartInstance.canvas.style.opacity = message.event === 'estimate' ? '0.8' : '1';
+            }, controller.signal);
         }
-        
-        drawForecast(backendDataCache);
 
     } catch (error) {
-        console.error("Ошибка при получении прогноза:", error);
+        if (error.name !== 'AbortError') {
+            console.error("Ошибка при получении прогноза:", error);
+        }
     } finally {
-        chartInstance.canvas.style.opacity = '1';
+        if (calculationController === controller) {
+            chartInstance.canvas.style.opacity = '1';
+        }
     }
 }
 
@@ -374,7 +374,8 @@ function handleSave() {
 
 async function fetchAllFunds() {
     if (!allFundsCache) {
-        const response = await fetch(API_URL_FUNDS);
+        // Только поля, которые показывает окно замены фонда
+        const response = await fetch(`${API_URL_FUNDS}?fields=name,risk_level,one_year_return_str,min_purchase_str,description`);
         if (!response.ok) throw new Error("Не удалось загрузить список фондов.");
         allFundsCache = await response.json();
     }